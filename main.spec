@@ -1,14 +1,51 @@
 # -*- mode: python ; coding: utf-8 -*-
 
+import os
+import json
+import shutil
+import struct
 from PyInstaller.utils.hooks import collect_dynamic_libs
 
 binaries = collect_dynamic_libs('llama_cpp')
 
+# Header layout and version of the asset pack, as in src/main.py.
+ASSET_PACK_HEADER = '<8sIII'
+ASSET_PACK_VERSION = 2
+
+def packed_assets(pack_path):
+    """Names of the assets a built asset pack makes unnecessary, or an empty set if there's no pack."""
+    if not os.path.exists(pack_path):
+        return set()
+
+    with open(pack_path, 'rb') as f:
+        magic, version, index_length, _ = struct.unpack(ASSET_PACK_HEADER, f.read(struct.calcsize(ASSET_PACK_HEADER)))
+        if magic != b'CLIPPACK' or version != ASSET_PACK_VERSION:
+            raise SystemExit(f'{pack_path} is from another version of Clippy, rebuild it with tools/build_asset_pack.py')
+        index = json.loads(f.read(index_length))
+
+    for name, stamp in index['sources'].items():
+        path = os.path.join('assets', name)
+        current = [os.path.getsize(path), os.path.getmtime(path)] if os.path.exists(path) else None
+        if current != stamp:
+            raise SystemExit(f'{pack_path} is out of date ({name} changed), rebuild it with tools/build_asset_pack.py')
+
+    # Only the atlas is left out. The sprite sheet, animations.json and the
+    # sounds stay, so the binary still starts, just slower, without the pack
+    # beside it, and sounds can be decoded if the mixer can't be opened in the
+    # pack's sound format.
+    return {name for name, stamp in index['sources'].items() if stamp is not None and name.startswith('clippy-atlas.')}
+
+# The asset pack is shipped beside the binary rather than inside it, so it is
+# memory mapped in place instead of being extracted on every launch. The
+# atlas, which it replaces, is left out.
+excluded = packed_assets(os.path.join('assets', 'clippy.pack')) | {'clippy.pack'}
+datas = [(os.path.join('assets', f), 'assets') for f in os.listdir('assets') if f not in excluded]
+
 a = Analysis(
     ['src/main.py'],
     pathex=[],
     binaries=binaries,
-    datas=[('assets', 'assets')],
+    datas=datas,
     hiddenimports=[],
     hookspath=[],
     hooksconfig={},
@@ -39,3 +76,6 @@ exe = EXE(
     codesign_identity=None,
     entitlements_file=None,
 )
+
+if os.path.exists(os.path.join('assets', 'clippy.pack')):
+    shutil.copy(os.path.join('assets', 'clippy.pack'), DISTPATH)
@@ -5,21 +5,33 @@ import os
 import json
 import random
 import markdown
-import base64
 from markdown.extensions.fenced_code import FencedCodeExtension
 from markdown.extensions.codehilite import CodeHiliteExtension
 from markdown.extensions.extra import ExtraExtension
 from markdown.extensions.toc import TocExtension
+from pygments.formatters import HtmlFormatter
 import html
 import requests
 import threading
 import gc
 import argparse
-from PySide6.QtWidgets import QApplication, QWidget, QMenu, QDialog, QVBoxLayout, QLineEdit, QSpacerItem, QSizePolicy, QSizeGrip, QFileDialog
-from PySide6.QtCore import Qt, QTimer, QPoint, QThread, QObject, Signal, Slot
-from PySide6.QtGui import QPainter, QPixmap, QAction, QPolygon, QColor, QDesktopServices
-from PySide6.QtWebEngineWidgets import QWebEngineView
-from PySide6.QtWebEngineCore import QWebEnginePage, QWebEngineSettings
+import sqlite3
+import re
+import hashlib
+import time
+import math
+import socket
+import queue
+import uuid
+import mmap
+import struct
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from collections import OrderedDict
+import numpy as np
+import tracing
+from PySide6.QtWidgets import QApplication, QWidget, QMenu, QDialog, QVBoxLayout, QLineEdit, QSpacerItem, QSizePolicy, QSizeGrip, QFileDialog, QListWidget, QListWidgetItem, QInputDialog, QTextBrowser
+from PySide6.QtCore import Qt, QTimer, QPoint, QPointF, QThread, QObject, Signal, Slot, QStandardPaths, QUrl
+from PySide6.QtGui import QPainter, QImage, QAction, QPolygon, QColor, QDesktopServices
 import pygame.mixer
 from llama_cpp import Llama
 
@@ -32,26 +44,176 @@ else:
 	base_path = os.path.dirname(__file__)
 	ASSETS_DIR = os.path.join(base_path, "..", "assets")
 
+# Layout of clippy-map.png.
+SPRITE_WIDTH = 124
+SPRITE_HEIGHT = 93
+SPRITE_COLUMNS = 27
+SPRITE_ROWS = 34
+
+# Asset pack written by tools/build_asset_pack.py: header, JSON index, then aligned data.
+ASSET_PACK_NAME = "clippy.pack"
+ASSET_PACK_MAGIC = b"CLIPPACK"
+ASSET_PACK_VERSION = 2
+ASSET_PACK_HEADER = "<8sIII"
+ASSET_PACK_ALIGNMENT = 64
+
+# (frequency, sample size, channels) packed sounds are decoded to. The mixer is opened in exactly this format when a pack is used.
+ASSET_PACK_SOUND_FORMAT = (44100, -16, 2)
+
 PROMPT_MENU_WIDTH = 300
 PROMPT_MENU_HEIGHT = 400
 
+SEARCH_RESULT_LIMIT = 50
+
+# Messages kept in the chat view at once, and how many more to bring back per scroll, older or newer.
+CHAT_WINDOW_MESSAGES = 40
+CHAT_MESSAGE_BATCH = 20
+
+# (connect, read) timeouts in seconds for API requests.
+HTTP_TIMEOUT = (10, 120)
+
+# How long exiting waits for workers to stop before giving up on them.
+SHUTDOWN_TIMEOUT_MS = 2000
+
+# How often to check whether the local model has been idle long enough to unload.
+IDLE_CHECK_INTERVAL_MS = 30000
+
+# Animation timing.
+MIN_FRAME_MS = 10
+PRECISE_TIMER_THRESHOLD_MS = 20
+MAX_FRAME_SKIP = 50
+
+# Sprite sizes offered in the menu, and how much memory pre-scaled frames may use.
+SCALE_FACTORS = (1, 1.5, 2, 3)
+FRAME_CACHE_BYTES = 64 * 2**20
+
+# --serve settings.
+SERVER_DEFAULT_ADDRESS = "127.0.0.1:8765"
+SERVER_MODEL_NAME = "clippy"
+SERVER_REMOTE_WORKERS = 4
+
+# Document retrieval settings.
+DOC_EXTENSIONS = (".md", ".txt", ".rst")
+DOC_CHUNK_CHARS = 1200
+DOC_EMBED_BATCH = 16
+DOC_TOP_K = 4
+DOC_TOKEN_BUDGET = 1000
+
 llm_instance = None
 llm_model_path = None
+llm_active_requests = 0
+llm_last_used = 0.0
 llama_lock = threading.Lock()
 
+# llama.cpp contexts aren't thread safe, so generations on the local model take turns.
+llama_generate_lock = threading.Lock()
+
+# One connection pool for every API request, so chat sessions reuse connections.
+http_pool = requests.Session()
+
+embedding_instance = None
+embedding_model_path = None
+embedding_active_requests = 0
+embedding_last_used = 0.0
+
+# Pygments styles for highlighted code, emitted once per page instead of inline on every token.
+CODEHILITE_CSS = HtmlFormatter().get_style_defs('.codehilite')
+
+# Stylesheet for the chat transcript.
+CHAT_CSS = """
+	body {
+		font-size: 10pt;
+		background-color: rgb(255, 255, 204);
+		overflow-y: scroll;
+		overflow-wrap: break-word;
+		max-height: 100vh;
+	}
+	.message {
+		padding: 5px;
+		border-radius: 5px;
+		margin-bottom: 5px;
+	}
+	.user {
+		text-align: right;
+		font-style: italic;
+	}
+	.bot {
+		text-align: left;
+	}
+	.codehilite pre {
+		overflow-x: auto;
+		white-space: pre;
+		display: block;
+		max-width: 100%;
+	}
+	.codehilite code {
+		display: block;
+		overflow-x: auto;
+		white-space: pre;
+		background-color: #f8f8f8;
+		padding: 5px;
+		border-radius: 5px;
+	}
+""" + CODEHILITE_CSS
+
+# The same look in the CSS subset QTextBrowser understands.
+LIGHT_CHAT_CSS = """
+	.message {
+		margin-bottom: 5px;
+	}
+	.user {
+		text-align: right;
+		font-style: italic;
+	}
+	.codehilite {
+		background-color: #f8f8f8;
+	}
+""" + CODEHILITE_CSS
+
 parser = argparse.ArgumentParser(description="Friendly paperclip AI assistant.")
 parser_group = parser.add_mutually_exclusive_group()
 parser_group.add_argument("-l", "--local", type=str, help="Specify file path to local model.", metavar='PATH')
 parser_group.add_argument("-a", "--openai", type=str, help="Specify OpenAI model to use.", metavar="MODEL")
 parser_group.add_argument("-r", "--openrouter", type=str, help="Specify OpenRouter model to use.", metavar="MODEL")
+parser_group.add_argument("-e", "--endpoint", type=str, help="Specify the URL of an OpenAI-compatible server to use, like one started with --serve.", metavar="URL")
+parser.add_argument("--serve", type=str, nargs="?", const=SERVER_DEFAULT_ADDRESS, help=f"Run without a GUI, serving the selected model as an OpenAI-compatible /v1/chat/completions endpoint. (default address: {SERVER_DEFAULT_ADDRESS})", metavar="HOST:PORT")
+parser.add_argument("-d", "--docs", type=str, help="Specify a folder of documents Clippy can answer questions about.", metavar="DIR")
+parser.add_argument("--embedding-model", type=str, help="Specify file path to the local model used to embed documents. Defaults to the --local model.", metavar="PATH")
+parser.add_argument("--idle-unload", type=float, default=15, help="Unload the local and embedding models after they have been idle for this many minutes. 0 keeps them loaded. (default: 15)", metavar="MINUTES")
+parser.add_argument("--no-prewarm", action="store_true", help="Don't start loading the local model when the prompt is opened.")
+parser.add_argument("--light-ui", action="store_true", help="Show the chat in a native text widget instead of QtWebEngine. Uses far less memory.")
+parser.add_argument("--scale", type=float, default=1, help="Size of Clippy, e.g. 2 for double size. (default: 1)", metavar="FACTOR")
+parser.add_argument("--trace", type=str, help="Record where time is spent and write it to a Chrome trace-event file, viewable in Perfetto.", metavar="PATH")
 args = parser.parse_args()
 
+# Must happen before the traced functions below are defined.
+if args.trace:
+	tracing.start(args.trace)
+
+# QtWebEngine has to be imported before the QApplication is created, so only do it when it will be used. --serve has no window.
+if not args.light_ui and not args.serve:
+	from webview import WebChatView
+
 def load_asset(filename):
 	"""Returns the full path to an asset file."""
 	return os.path.join(ASSETS_DIR, filename)
 
-def load_animations(json_path, sheet_columns):
-	"""Load animations.json and return dict: name -> {'Frames': [...], 'Loops': [...]}"""
+def load_atlas(json_path):
+	"""Load the sprite atlas index written by tools/build_atlas.py, or None if it has not been built."""
+	if not os.path.exists(json_path):
+		return None
+
+	try:
+		with open(json_path, 'r', encoding='utf-8') as f:
+			return json.load(f)
+	except Exception as e:
+		print(f"Warning: Failed to load sprite atlas: {e}")
+		return None
+
+def load_animations(json_path, sheet_columns, frame_map=None):
+	"""Load animations.json and return dict: name -> {'Frames': [...], 'Loops': [...]}
+
+	If frame_map is given, sheet cell indices are translated through it (see load_atlas)."""
 	with open(json_path, 'r', encoding='utf-8') as f:
 		data = json.load(f)
 
@@ -75,6 +237,8 @@ def load_animations(json_path, sheet_columns):
 				col, row = last_col, last_row
 
 			index = row * sheet_columns + col
+			if frame_map is not None:
+				index = frame_map[index]
 			sound_path = load_asset(sound) if sound else None
 			frames.append((index, duration, sound_path))
 
@@ -85,8 +249,117 @@ def load_animations(json_path, sheet_columns):
 
 	return animations
 
+def asset_stamp(name):
+	"""[size, mtime] of an asset file, or None if it doesn't exist. Asset packs record these to notice when their sources change."""
+	path = load_asset(name)
+	if not os.path.exists(path):
+		return None
+	return [os.path.getsize(path), os.path.getmtime(path)]
+
+class AssetPack:
+	"""Read-only memory map of an asset pack. Processes mapping the same file share its pages."""
+
+	def __init__(self, path):
+		with open(path, "rb") as f:
+			self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		self.data = memoryview(self.map)
+
+		header_size = struct.calcsize(ASSET_PACK_HEADER)
+		magic, version, index_length, self.data_offset = struct.unpack(ASSET_PACK_HEADER, self.data[:header_size])
+		if magic != ASSET_PACK_MAGIC or version != ASSET_PACK_VERSION:
+			raise ValueError(f"{path} is not a version {ASSET_PACK_VERSION} asset pack")
+		self.index = json.loads(bytes(self.data[header_size:header_size + index_length]))
+		self.warned_sound_format = False
+
+	def changed_source(self):
+		"""Name of the first asset that changed since the pack was built, or None if it is up to date.
+
+		Sources that are missing are fine, packaged builds leave out the atlas."""
+		for name, stamp in self.index["sources"].items():
+			current = asset_stamp(name)
+			if stamp is None and current is not None:
+				# Built without it, e.g. the atlas was built after the pack.
+				return name
+			if stamp is not None and current is not None and current != stamp:
+				return name
+		return None
+
+	def sound_format(self):
+		return tuple(self.index["sound_format"])
+
+	def blob(self, entry):
+		start = self.data_offset + entry["offset"]
+		return self.data[start:start + entry["length"]]
+
+	def sheet_image(self):
+		"""The sprite sheet, drawn straight from the mapped pixels."""
+		sheet = self.index["sheet"]
+		return QImage(self.blob(sheet), sheet["width"], sheet["height"], sheet["bytes_per_line"], QImage.Format_ARGB32_Premultiplied)
+
+	def frames(self):
+		return [tuple(frame) for frame in self.index["frames"]]
+
+	def animations(self):
+		"""The animation table in the form load_animations() returns."""
+		animations = {}
+		for name, animation in self.index["animations"].items():
+			frames = [(index, duration, load_asset(sound) if sound else None) for index, duration, sound in animation["Frames"]]
+			animations[name] = {"Frames": frames, "Loops": animation["Loops"]}
+		return animations
+
+	def sound(self, name):
+		"""A sound from its decoded samples, or None if it isn't packed or the mixer uses another format."""
+		entry = self.index["sounds"].get(name)
+		if entry is None:
+			return None
+
+		mixer_format = pygame.mixer.get_init()
+		if mixer_format != self.sound_format():
+			if not self.warned_sound_format:
+				print(f"Warning: The mixer uses {mixer_format} instead of the asset pack's {self.sound_format()}, decoding sounds from their files.")
+				self.warned_sound_format = True
+			return None
+		return pygame.mixer.Sound(buffer=self.blob(entry))
+
+def load_asset_pack():
+	"""Map the asset pack if it has been built, or return None. Without it the separate assets are loaded, which is only slower.
+
+	A frozen build looks next to the executable first, so the pack can be shipped beside it instead of being extracted on every launch."""
+	paths = [load_asset(ASSET_PACK_NAME)]
+	if getattr(sys, 'frozen', False):
+		paths.insert(0, os.path.join(os.path.dirname(sys.executable), ASSET_PACK_NAME))
+
+	for path in paths:
+		if os.path.exists(path):
+			try:
+				pack = AssetPack(path)
+			except (OSError, ValueError) as e:
+				print(f"Warning: Failed to load asset pack: {e}")
+				continue
+
+			# Files extracted from a frozen build get new modification times, the spec checked the pack when it was built.
+			changed = None if getattr(sys, 'frozen', False) else pack.changed_source()
+			if changed:
+				print(f"Warning: {changed} changed since {path} was built, loading the separate assets. Rebuild it with tools/build_asset_pack.py.")
+				continue
+			return pack
+	return None
+
+def get_rss_mb():
+	"""Resident memory of this process in MiB, or None where it can't be read."""
+	try:
+		with open("/proc/self/statm", 'r') as f:
+			return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+	except (OSError, ValueError, AttributeError):
+		return None
+
+def format_rss():
+	rss = get_rss_mb()
+	return f"{rss:.0f} MiB" if rss is not None else "unknown"
+
 def get_llama_instance(model_path: str):
-	global llm_instance, llm_model_path
+	"""Return the local model, loading it if needed, and mark it in use until release_llama_instance()."""
+	global llm_instance, llm_model_path, llm_active_requests, llm_last_used
 
 	# Reset llm_instance to None if it becomes undefined. This can happen if we load an invalid .gguf file.
 	try:
@@ -102,14 +375,353 @@ def get_llama_instance(model_path: str):
 				gc.collect()
 
 			try:
+				start = time.monotonic()
 				llm_instance = Llama(model_path=model_path)
 				llm_model_path = model_path
+				print(f"Loaded local model {model_path} in {time.monotonic() - start:.1f}s (RSS {format_rss()})")
 			except Exception as e:
 				return {"error": f"Failed to load local model: {e}"}
+
+		llm_active_requests += 1
+		llm_last_used = time.monotonic()
 	return llm_instance
 
-def prompt_ai(prompt, system_message, history, api_key, model, service):
-	"""Send a prompt to the preferred AI API."""
+def release_llama_instance():
+	"""Mark one use of the local model as finished."""
+	global llm_active_requests, llm_last_used
+
+	with llama_lock:
+		llm_active_requests -= 1
+		llm_last_used = time.monotonic()
+
+def prewarm_llama_instance(model_path: str):
+	"""Load the local model ahead of the next prompt."""
+	llm = get_llama_instance(model_path)
+	if isinstance(llm, dict):
+		print(llm["error"])
+		return
+	release_llama_instance()
+
+def unload_idle_llama_instance(idle_seconds):
+	"""Free the local model and its KV cache, and the embedding model, if nothing has used them for idle_seconds."""
+	global llm_instance, embedding_instance
+
+	# Don't stall the caller behind a model that is loading.
+	if not llama_lock.acquire(blocking=False):
+		return
+
+	try:
+		now = time.monotonic()
+
+		# Keep the model paths so the next use reloads the same models.
+		if llm_instance is not None and llm_active_requests == 0 and now - llm_last_used >= idle_seconds:
+			if hasattr(llm_instance, "close"):
+				llm_instance.close()
+			llm_instance = None
+			gc.collect()
+			print(f"Unloaded idle local model {llm_model_path} (RSS {format_rss()})")
+
+		if embedding_instance is not None and embedding_active_requests == 0 and now - embedding_last_used >= idle_seconds:
+			if hasattr(embedding_instance, "close"):
+				embedding_instance.close()
+			embedding_instance = None
+			gc.collect()
+			print(f"Unloaded idle embedding model {embedding_model_path} (RSS {format_rss()})")
+	finally:
+		llama_lock.release()
+
+@tracing.traced("render_markdown")
+def render_markdown(md_text):
+	"""Convert a markdown message to HTML with class-based code highlighting."""
+	return markdown.markdown(md_text, extensions=[ExtraExtension(), CodeHiliteExtension(), FencedCodeExtension(), TocExtension(baselevel=2)])
+
+@tracing.traced("render_messages")
+def render_messages(exchanges):
+	"""Render chat history exchanges to a list of message HTML."""
+	messages_html = []
+	for i, msg in enumerate(exchanges):
+		role = msg.get("role", "assistant")
+		content = msg.get("content", "")
+
+		if role == "assistant":
+			# Render Markdown to HTML for assistant messages
+			message_html = f"<div id='msg-{i}' class='message bot'>{render_markdown(content)}</div>"
+		else:
+			# Escape and render user message as-is
+			safe_text = html.escape(content)
+			message_html = f"<div id='msg-{i}' class='message user'>{safe_text}</div>"
+
+		messages_html.append(message_html)
+	return messages_html
+
+def get_embedding_instance(model_path: str):
+	"""Return a Llama instance in embedding mode, loading it if needed, and mark it in use until release_embedding_instance()."""
+	global embedding_instance, embedding_model_path, embedding_active_requests, embedding_last_used
+
+	with llama_lock:
+		if embedding_instance is None or embedding_model_path != model_path:
+			embedding_instance = None
+			gc.collect()
+
+			embedding_instance = Llama(model_path=model_path, embedding=True, verbose=False)
+			embedding_model_path = model_path
+
+		embedding_active_requests += 1
+		embedding_last_used = time.monotonic()
+	return embedding_instance
+
+def release_embedding_instance():
+	"""Mark one use of the embedding model as finished."""
+	global embedding_active_requests, embedding_last_used
+
+	with llama_lock:
+		embedding_active_requests -= 1
+		embedding_last_used = time.monotonic()
+
+def estimate_tokens(text):
+	"""Rough token count for budgeting prompt context."""
+	return len(text) // 4 + 1
+
+def chunk_text(text):
+	"""Split a document into paragraph aligned chunks of at most DOC_CHUNK_CHARS characters."""
+	chunks = []
+	current = ""
+	for paragraph in re.split(r"\n\s*\n", text):
+		paragraph = paragraph.strip()
+		if not paragraph:
+			continue
+
+		# Hard split paragraphs that are too long on their own.
+		while len(paragraph) > DOC_CHUNK_CHARS:
+			if current:
+				chunks.append(current)
+				current = ""
+			chunks.append(paragraph[:DOC_CHUNK_CHARS])
+			paragraph = paragraph[DOC_CHUNK_CHARS:]
+
+		if current and len(current) + len(paragraph) + 2 > DOC_CHUNK_CHARS:
+			chunks.append(current)
+			current = ""
+		current = f"{current}\n\n{paragraph}" if current else paragraph
+
+	if current:
+		chunks.append(current)
+	return chunks
+
+class DocIndex:
+	"""Embedding index over a folder of documents, stored as a memory-mapped NumPy matrix."""
+	def __init__(self, docs_dir, model_path, index_dir):
+		self.docs_dir = os.path.abspath(docs_dir)
+		self.model_path = model_path
+		self.matrix_path = os.path.join(index_dir, "embeddings.npy")
+		self.meta_path = os.path.join(index_dir, "index.json")
+		self.lock = threading.Lock()
+
+		# files: relative path -> {"mtime", "size", "start", "end"} rows in the matrix.
+		# chunks: [relative path, text] for every matrix row.
+		self.files = {}
+		self.chunks = []
+		self.matrix = None
+
+		os.makedirs(index_dir, exist_ok=True)
+		try:
+			with open(self.meta_path, 'r', encoding='utf-8') as f:
+				meta = json.load(f)
+			if meta.get("model") == model_path:
+				# Only keep the metadata if the matrix loads and has a row for every chunk, or nothing would be re-embedded.
+				matrix = np.load(self.matrix_path, mmap_mode="r") if meta["chunks"] else None
+				rows = 0 if matrix is None else matrix.shape[0]
+				if rows != len(meta["chunks"]):
+					raise ValueError(f"index.json lists {len(meta['chunks'])} chunks but there are {rows} embeddings")
+				self.files, self.chunks, self.matrix = meta["files"], meta["chunks"], matrix
+		except FileNotFoundError:
+			pass
+		except Exception as e:
+			print(f"Warning: Rebuilding document index: {e}")
+			self.files, self.chunks, self.matrix = {}, [], None
+
+	def scan(self):
+		"""Return {relative path: (mtime, size)} for every document in the folder."""
+		found = {}
+		for root, _, filenames in os.walk(self.docs_dir):
+			for filename in filenames:
+				if filename.lower().endswith(DOC_EXTENSIONS):
+					path = os.path.join(root, filename)
+					stat = os.stat(path)
+					found[os.path.relpath(path, self.docs_dir)] = (stat.st_mtime, stat.st_size)
+		return found
+
+	def embed(self, texts):
+		"""Embed texts in batches and return L2-normalised rows."""
+		model = get_embedding_instance(self.model_path)
+		rows = []
+		try:
+			for i in range(0, len(texts), DOC_EMBED_BATCH):
+				for vector in model.embed(texts[i:i + DOC_EMBED_BATCH]):
+					vector = np.asarray(vector, dtype=np.float32)
+
+					# Models without pooling return one vector per token.
+					if vector.ndim == 2:
+						vector = vector.mean(axis=0)
+					rows.append(vector / (np.linalg.norm(vector) or 1.0))
+		finally:
+			release_embedding_instance()
+		return np.vstack(rows)
+
+	def refresh(self):
+		"""Re-embed documents that were added or changed since the last refresh."""
+		with self.lock:
+			current = self.scan()
+			if current.keys() == self.files.keys() and all(tuple(current[rel]) == (info["mtime"], info["size"]) for rel, info in self.files.items()):
+				return
+
+			files = {}
+			chunks = []
+			blocks = []
+			for rel, (mtime, size) in sorted(current.items()):
+				old = self.files.get(rel)
+				if old and (old["mtime"], old["size"]) == (mtime, size):
+					# Unchanged, reuse the stored rows.
+					texts = [text for _, text in self.chunks[old["start"]:old["end"]]]
+					vectors = np.array(self.matrix[old["start"]:old["end"]]) if texts else None
+				else:
+					print(f"Indexing document: {rel}")
+					with open(os.path.join(self.docs_dir, rel), 'r', encoding='utf-8', errors='replace') as f:
+						texts = chunk_text(f.read())
+					vectors = self.embed(texts) if texts else None
+
+				files[rel] = {"mtime": mtime, "size": size, "start": len(chunks), "end": len(chunks) + len(texts)}
+				chunks.extend([rel, text] for text in texts)
+				if vectors is not None:
+					blocks.append(vectors)
+
+			# Write the new matrix next to the old one and swap it in.
+			self.matrix = None
+			if blocks:
+				matrix = np.vstack(blocks)
+				temp_path = self.matrix_path + ".tmp"
+				out = np.lib.format.open_memmap(temp_path, mode="w+", dtype=np.float32, shape=matrix.shape)
+				out[:] = matrix
+				out.flush()
+				del out
+				os.replace(temp_path, self.matrix_path)
+				self.matrix = np.load(self.matrix_path, mmap_mode="r")
+
+			self.files = files
+			self.chunks = chunks
+			temp_path = self.meta_path + ".tmp"
+			with open(temp_path, 'w', encoding='utf-8') as f:
+				json.dump({"model": self.model_path, "files": files, "chunks": chunks}, f)
+			os.replace(temp_path, self.meta_path)
+
+	@tracing.traced("DocIndex.retrieve")
+	def retrieve(self, query, top_k=DOC_TOP_K, token_budget=DOC_TOKEN_BUDGET):
+		"""Return the chunks most similar to query as a context message, or None."""
+		self.refresh()
+
+		with self.lock:
+			if self.matrix is None:
+				return None
+
+			scores = self.matrix @ self.embed([query])[0]
+			k = min(top_k, len(scores))
+			best = np.argpartition(-scores, k - 1)[:k]
+			best = best[np.argsort(-scores[best])]
+
+			parts = []
+			used = 0
+			for i in best:
+				rel, text = self.chunks[i]
+				cost = estimate_tokens(text)
+				if used + cost > token_budget:
+					continue
+				parts.append(f"[{rel}]\n{text}")
+				used += cost
+
+		if not parts:
+			return None
+		return "Relevant excerpts from the user's documents:\n\n" + "\n\n".join(parts)
+
+class CancelToken:
+	"""Lets the GUI thread stop a generation running in a worker."""
+	def __init__(self):
+		self.event = threading.Event()
+		self.lock = threading.Lock()
+		self.response = None
+
+	def cancel(self):
+		self.event.set()
+		with self.lock:
+			response = self.response
+		if response is not None:
+			self.shutdown_stream(response)
+
+	def is_cancelled(self):
+		return self.event.is_set()
+
+	def attach(self, response):
+		"""Remember the HTTP response to shut down on cancel."""
+		with self.lock:
+			self.response = response
+		if self.is_cancelled():
+			self.shutdown_stream(response)
+
+	def shutdown_stream(self, response):
+		# Closing the response from here doesn't wake a worker blocked reading the socket, shutting the socket down does.
+		connection = getattr(response.raw, "connection", None)
+		sock = getattr(connection, "sock", None)
+		if sock is not None:
+			try:
+				sock.shutdown(socket.SHUT_RDWR)
+			except OSError:
+				pass
+
+def iter_sse_chunks(api_response):
+	"""Yield the JSON chunks of an OpenAI style server-sent event stream."""
+	# Event streams are always UTF-8, but without a charset requests would decode them as ISO-8859-1.
+	api_response.encoding = "utf-8"
+
+	# chunk_size=None hands over data as soon as it arrives instead of waiting to fill a buffer.
+	for line in api_response.iter_lines(chunk_size=None, decode_unicode=True):
+		if not line or not line.startswith("data:"):
+			continue
+
+		data = line[len("data:"):].strip()
+		if data == "[DONE]":
+			return
+		yield json.loads(data)
+
+def collect_stream(chunks, cancel_token=None, on_token=None):
+	"""Join streamed completion chunks into a regular chat completion response, stopping early on cancel."""
+	content = []
+	cancelled = False
+	try:
+		for chunk in chunks:
+			if cancel_token is not None and cancel_token.is_cancelled():
+				cancelled = True
+				break
+
+			if "error" in chunk:
+				error = chunk["error"]
+				return {"error": error.get("message", str(error)) if isinstance(error, dict) else str(error)}
+
+			choices = chunk.get("choices")
+			if choices:
+				delta = choices[0].get("delta", {}).get("content")
+				if delta:
+					content.append(delta)
+					if on_token is not None:
+						on_token(delta)
+	except Exception:
+		# Closing the stream from another thread surfaces as an exception here.
+		if cancel_token is None or not cancel_token.is_cancelled():
+			raise
+		cancelled = True
+
+	return {"choices": [{"message": {"role": "assistant", "content": "".join(content)}}], "cancelled": cancelled}
+
+def build_messages(prompt, system_message, history, context=None):
+	"""Build the chat completion message list for a prompt."""
 	messages=[]
 
 	# Construct the message part of the API request
@@ -120,10 +732,25 @@ def prompt_ai(prompt, system_message, history, api_key, model, service):
 	if "exchanges" in history:
 		messages.extend(history["exchanges"])
 
+	# Add retrieved document context right before the prompt
+	if context:
+		messages.append({"role": "system", "content": context})
+
 	# Add current prompt to messages
 	messages.append({"role": "user", "content": prompt})
 
-	request_data = {"model": model, "messages": messages}
+	return messages
+
+def prompt_ai(prompt, system_message, history, api_key, model, service, context=None, cancel_token=None):
+	"""Send a prompt to the preferred AI API. context is an optional system message placed before the prompt.
+
+	Replies are streamed so that cancel_token can stop them part way; the partial reply is returned with "cancelled" set."""
+	return complete_chat(build_messages(prompt, system_message, history, context), api_key, model, service, cancel_token)
+
+@tracing.traced("complete_chat")
+def complete_chat(messages, api_key, model, service, cancel_token=None, on_token=None):
+	"""Run a chat completion on the preferred AI API. on_token is called with each piece of the reply as it streams in."""
+	request_data = {"model": model, "messages": messages, "stream": True}
 
 	if service != "Local":
 		if service == "OpenAI":
@@ -132,18 +759,26 @@ def prompt_ai(prompt, system_message, history, api_key, model, service):
 		elif service == "OpenRouter":
 			request_header = {"Content-Type": "application/json", "Authorization": f"Bearer {api_key}"}
 			url = "https://openrouter.ai/api/v1/chat/completions"
+		elif service == "Server":
+			# The model is the server's base URL; the server decides which model answers.
+			request_header = {"Content-Type": "application/json"}
+			url = model.rstrip("/") + "/v1/chat/completions"
+			request_data["model"] = SERVER_MODEL_NAME
 	
 		try:
 			# Send the request to the API
-			api_response = requests.post(url, json=request_data, headers=request_header)
+			api_response = http_pool.post(url, json=request_data, headers=request_header, stream=True, timeout=HTTP_TIMEOUT)
+			if cancel_token is not None:
+				cancel_token.attach(api_response)
 	
 			# Raise HTTPError for bad responses
 			api_response.raise_for_status()
 	
-			return api_response.json()
+			with api_response:
+				return collect_stream(iter_sse_chunks(api_response), cancel_token, on_token)
 		except requests.exceptions.HTTPError as http_err:
 			print(f"HTTP error occured: {http_err}")
-			return {"error": f"HTTP error: {response.status_code} - {response.text}"}
+			return {"error": f"HTTP error: {http_err.response.status_code} - {http_err.response.text}"}
 		except requests.exceptions.ConnectionError:
 			print(f"Connection error: Failed to reach API")
 			return {"error": "Connection error: Unable to reach API."}
@@ -156,11 +791,529 @@ def prompt_ai(prompt, system_message, history, api_key, model, service):
 	else:
 		# Logic for using llama.
 		llm = get_llama_instance(model)
-		chat_messages = request_data["messages"]
-		response = llm.create_chat_completion(messages=chat_messages)
+		if isinstance(llm, dict):
+			return llm
+
+		try:
+			chat_messages = request_data["messages"]
+			with llama_generate_lock:
+				stream = llm.create_chat_completion(messages=chat_messages, stream=True)
+				response = collect_stream(stream, cancel_token, on_token)
+				stream.close()
+		finally:
+			release_llama_instance()
 
 	return response
 
+def get_api_key(service):
+	"""Read the API key for a service from the environment."""
+	if service == "OpenAI":
+		return os.getenv("OPENAI_API_KEY", "").strip()
+	elif service == "OpenRouter":
+		return os.getenv("OPENROUTER_API_KEY", "").strip()
+	return ""
+
+def default_ai_model():
+	"""Return the (service, model) picked on the command line."""
+	if args.local:
+		return "Local", args.local
+	elif args.openrouter:
+		return "OpenRouter", args.openrouter
+	elif args.openai:
+		return "OpenAI", args.openai
+	elif args.endpoint:
+		return "Server", args.endpoint
+	return "OpenAI", "gpt-4o-mini"
+
+class GenerationQueue:
+	"""Runs chat completions for the server in arrival order on a fixed number of threads."""
+	def __init__(self, api_key, model, service, workers):
+		self.api_key = api_key
+		self.model = model
+		self.service = service
+		self.jobs = queue.Queue()
+
+		for _ in range(workers):
+			threading.Thread(target=self.run, daemon=True).start()
+
+	def submit(self, messages):
+		"""Queue a completion. Returns (events, cancel_token); events receives ("token", text) items and then ("done", response)."""
+		events = queue.Queue()
+		cancel_token = CancelToken()
+		self.jobs.put((messages, events, cancel_token))
+		return events, cancel_token
+
+	def run(self):
+		while True:
+			messages, events, cancel_token = self.jobs.get()
+
+			# The client went away while waiting.
+			if cancel_token.is_cancelled():
+				continue
+
+			try:
+				response = complete_chat(messages, self.api_key, self.model, self.service, cancel_token, lambda text: events.put(("token", text)))
+			except Exception as e:
+				response = {"error": f"Unhandled exception in server: {str(e)}"}
+			events.put(("done", response))
+
+class ChatCompletionHandler(BaseHTTPRequestHandler):
+	"""OpenAI-compatible /v1/chat/completions endpoint backed by the server's GenerationQueue."""
+	protocol_version = "HTTP/1.1"
+
+	def do_GET(self):
+		if self.path.rstrip("/") == "/v1/models":
+			self.send_json(200, {"object": "list", "data": [{"id": SERVER_MODEL_NAME, "object": "model", "owned_by": "clippy-gpt"}]})
+		else:
+			self.send_json(404, {"error": {"message": "Not found."}})
+
+	def do_POST(self):
+		if self.path.rstrip("/") != "/v1/chat/completions":
+			self.send_json(404, {"error": {"message": "Not found."}})
+			return
+
+		try:
+			request_data = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+			messages = request_data["messages"]
+		except (ValueError, KeyError, TypeError):
+			self.send_json(400, {"error": {"message": "Expected a JSON body with messages."}})
+			return
+
+		events, cancel_token = self.server.generation_queue.submit(messages)
+		completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+
+		if request_data.get("stream"):
+			self.stream_completion(completion_id, events, cancel_token)
+			return
+
+		while True:
+			kind, value = events.get()
+			if kind == "done":
+				break
+
+		if "error" in value:
+			self.send_json(500, {"error": {"message": value["error"]}})
+		else:
+			self.send_json(200, {
+				"id": completion_id,
+				"object": "chat.completion",
+				"created": int(time.time()),
+				"model": SERVER_MODEL_NAME,
+				"choices": [{"index": 0, "message": value["choices"][0]["message"], "finish_reason": "stop"}],
+			})
+
+	def stream_completion(self, completion_id, events, cancel_token):
+		self.send_response(200)
+		self.send_header("Content-Type", "text/event-stream")
+		self.send_header("Cache-Control", "no-cache")
+		self.send_header("Transfer-Encoding", "chunked")
+		self.end_headers()
+
+		def chunk(delta, finish_reason=None):
+			return {
+				"id": completion_id,
+				"object": "chat.completion.chunk",
+				"created": int(time.time()),
+				"model": SERVER_MODEL_NAME,
+				"choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+			}
+
+		try:
+			self.send_event(chunk({"role": "assistant"}))
+			while True:
+				kind, value = events.get()
+				if kind == "token":
+					self.send_event(chunk({"content": value}))
+				elif "error" in value:
+					self.send_event({"error": {"message": value["error"]}})
+					break
+				else:
+					self.send_event(chunk({}, "stop"))
+					break
+
+			self.write_chunk(b"data: [DONE]\n\n")
+			self.write_chunk(b"")
+		except OSError:
+			# Client disconnected, stop generating for it.
+			cancel_token.cancel()
+			self.close_connection = True
+
+	def send_event(self, data):
+		self.write_chunk(b"data: " + json.dumps(data).encode("utf-8") + b"\n\n")
+
+	def write_chunk(self, data):
+		self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+		self.wfile.flush()
+
+	def send_json(self, status, data):
+		body = json.dumps(data).encode("utf-8")
+		self.send_response(status)
+		self.send_header("Content-Type", "application/json")
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, format, *log_args):
+		print(f"[server] {self.address_string()} - {format % log_args}")
+
+def serve(address):
+	"""Serve the backend picked on the command line until interrupted."""
+	host, _, port = address.rpartition(":")
+	service, model = default_ai_model()
+
+	# A local model has a single context, so its requests run one at a time.
+	workers = 1 if service == "Local" else SERVER_REMOTE_WORKERS
+
+	server = ThreadingHTTPServer((host or "127.0.0.1", int(port)), ChatCompletionHandler)
+	server.daemon_threads = True
+	server.generation_queue = GenerationQueue(get_api_key(service), model, service, workers)
+
+	# Release the local model when it sits unused.
+	if args.idle_unload > 0:
+		def unload_loop():
+			while True:
+				time.sleep(IDLE_CHECK_INTERVAL_MS / 1000)
+				unload_idle_llama_instance(args.idle_unload * 60)
+		threading.Thread(target=unload_loop, daemon=True).start()
+
+	print(f"Serving {service} model {model} on http://{server.server_address[0]}:{server.server_address[1]}/v1/chat/completions")
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+
+class FrameClock:
+	"""Absolute frame deadlines on a monotonic clock, so time spent between frames doesn't accumulate."""
+	def __init__(self, now=time.monotonic):
+		self.now = now
+		self.deadline = 0.0
+
+	def start(self, duration_ms):
+		"""Start timing from now with a frame of duration_ms."""
+		self.deadline = self.now() + duration_ms / 1000
+
+	def advance(self, duration_ms):
+		"""Move the deadline on by one frame, relative to the last deadline rather than now."""
+		self.deadline += duration_ms / 1000
+
+	def remaining_ms(self):
+		"""Milliseconds until the current frame is due to end. Negative when behind."""
+		return (self.deadline - self.now()) * 1000
+
+class ChatSession:
+	"""A named conversation, kept in a JSON Lines file: a header line, then one line per message.
+
+	New messages are appended to the file, so saving costs the same however long the chat gets."""
+
+	def __init__(self, path, name, created=None, source=None, chat_index=None):
+		self.id = os.path.splitext(os.path.basename(path))[0]
+		self.path = path
+		self.name = name
+		self.created = created if created is not None else time.time()
+
+		# The saved chat file this session was opened from, if any.
+		self.source = source
+
+		# Kept up to date with the file, so chat search finds the session.
+		self.chat_index = chat_index
+
+		# Read from the file the first time the session is opened.
+		self.chat_history = None
+
+		# Rendered message HTML, kept once the session has been shown.
+		self.messages_html = None
+
+		self.generating = 0
+		self.unread = False
+
+	@classmethod
+	def open(cls, path, chat_index=None):
+		"""Read a session's header. Its messages are read by load()."""
+		with open(path, "r", encoding="utf-8") as file:
+			header = json.loads(file.readline())
+		return cls(path, header.get("name", "Chat"), header.get("created", 0), header.get("source"), chat_index)
+
+	def header(self):
+		return json.dumps({"name": self.name, "created": self.created, "source": self.source})
+
+	def load(self):
+		if self.chat_history is not None:
+			return
+
+		exchanges = []
+		try:
+			with open(self.path, "r", encoding="utf-8") as file:
+				file.readline()
+				for line in file:
+					if line.strip():
+						exchanges.append(json.loads(line))
+		except FileNotFoundError:
+			pass
+		except (OSError, ValueError) as e:
+			print(f"Failed to load session {self.name}: {e}")
+		self.chat_history = {"exchanges": exchanges}
+
+	def append(self, *messages):
+		"""Add messages to the history and the end of the file."""
+		self.load()
+		start = len(self.chat_history["exchanges"])
+		self.chat_history["exchanges"].extend(messages)
+		try:
+			with open(self.path, "a", encoding="utf-8") as file:
+				for message in messages:
+					file.write(json.dumps(message) + "\n")
+		except OSError as e:
+			print(f"Failed to save session {self.name}: {e}")
+			return
+
+		if self.chat_index is not None:
+			try:
+				self.chat_index.add_messages(self.path, start, messages)
+			except (OSError, sqlite3.Error) as e:
+				print(f"Failed to index session {self.name}: {e}")
+
+	def save(self):
+		"""Rewrite the whole file, after the history was replaced or the session renamed."""
+		self.load()
+		temp_path = self.path + ".tmp"
+		try:
+			with open(temp_path, "w", encoding="utf-8") as file:
+				file.write(self.header() + "\n")
+				for message in self.chat_history["exchanges"]:
+					file.write(json.dumps(message) + "\n")
+			os.replace(temp_path, self.path)
+		except OSError as e:
+			print(f"Failed to save session {self.name}: {e}")
+			return
+
+		self.index()
+
+	def index(self):
+		"""Reindex the whole session for chat search."""
+		if self.chat_index is None:
+			return
+
+		self.load()
+		try:
+			self.chat_index.index_chat(self.path, self.chat_history)
+		except (OSError, sqlite3.Error) as e:
+			print(f"Failed to index session {self.name}: {e}")
+
+	def delete(self):
+		try:
+			os.remove(self.path)
+		except FileNotFoundError:
+			pass
+		except OSError as e:
+			print(f"Failed to delete session {self.name}: {e}")
+
+		if self.chat_index is not None:
+			try:
+				self.chat_index.remove_chat(self.path)
+			except sqlite3.Error as e:
+				print(f"Failed to unindex session {self.name}: {e}")
+
+def load_sessions(sessions_dir, chat_index=None):
+	"""Open every saved chat session, oldest first, indexing any that changed since they were last indexed."""
+	sessions = []
+	try:
+		os.makedirs(sessions_dir, exist_ok=True)
+		paths = [os.path.join(sessions_dir, f) for f in os.listdir(sessions_dir) if f.endswith(".jsonl")]
+	except OSError as e:
+		print(f"Warning: Chat sessions can't be saved: {e}")
+		return sessions
+
+	for path in paths:
+		try:
+			session = ChatSession.open(path, chat_index)
+		except (OSError, ValueError) as e:
+			print(f"Failed to open session {path}: {e}")
+			continue
+
+		sessions.append(session)
+		try:
+			stale = chat_index is not None and chat_index.is_stale(path)
+		except (OSError, sqlite3.Error) as e:
+			print(f"Failed to check session index {path}: {e}")
+			stale = False
+		if stale:
+			session.index()
+
+	# Only sessions are searched. Drop chats indexed before that, or deleted while Clippy wasn't running.
+	if chat_index is not None:
+		try:
+			chat_index.remove_chats_except(session.path for session in sessions)
+		except sqlite3.Error as e:
+			print(f"Failed to prune chat index: {e}")
+
+	sessions.sort(key=lambda session: session.created)
+	return sessions
+
+class ScaledFrameCache:
+	"""Bounded LRU cache of sprite frames pre-scaled to device pixels. Safe to use from any thread."""
+
+	def __init__(self, sheet, frames, max_bytes=FRAME_CACHE_BYTES):
+		self.sheet = sheet
+		self.frames = frames
+		self.max_bytes = max_bytes
+		self.images = OrderedDict()
+		self.size_bytes = 0
+		self.lock = threading.Lock()
+		self.prescale_cancel = None
+		self.prescale_thread = None
+
+	def scale_frame(self, frame_index, scale, device_pixel_ratio):
+		x, y, width, height, _, _ = self.frames[frame_index]
+		device_scale = scale * device_pixel_ratio
+
+		# Whole number scales keep the pixel art crisp, anything else is smoothed.
+		mode = Qt.FastTransformation if float(device_scale).is_integer() else Qt.SmoothTransformation
+		image = self.sheet.copy(x, y, width, height)
+		image = image.scaled(max(1, round(width * device_scale)), max(1, round(height * device_scale)), Qt.IgnoreAspectRatio, mode)
+		image = image.convertToFormat(QImage.Format_ARGB32_Premultiplied)
+		image.setDevicePixelRatio(device_pixel_ratio)
+		return image
+
+	def insert(self, key, image, evict=True):
+		"""Add a scaled frame. Returns False if evict is False and there is no room for it."""
+		with self.lock:
+			if key in self.images:
+				return True
+
+			size = image.sizeInBytes()
+			if not evict and self.size_bytes + size > self.max_bytes:
+				return False
+
+			self.images[key] = image
+			self.size_bytes += size
+			while self.size_bytes > self.max_bytes and len(self.images) > 1:
+				_, evicted = self.images.popitem(last=False)
+				self.size_bytes -= evicted.sizeInBytes()
+			return True
+
+	def get(self, frame_index, scale, device_pixel_ratio):
+		"""Return a frame scaled for drawing at scale on a screen with device_pixel_ratio, scaling it now if needed."""
+		key = (frame_index, scale, device_pixel_ratio)
+		with self.lock:
+			image = self.images.get(key)
+			if image is not None:
+				self.images.move_to_end(key)
+				return image
+
+		image = self.scale_frame(frame_index, scale, device_pixel_ratio)
+		self.insert(key, image)
+		return image
+
+	def prescale(self, frame_indexes, scale, device_pixel_ratio):
+		"""Scale frames in the background, in order, until the cache is full. Stops any earlier prescale."""
+		self.stop_prescale(wait=False)
+		self.prescale_cancel = threading.Event()
+		self.prescale_thread = threading.Thread(target=self.prescale_frames, args=(list(frame_indexes), scale, device_pixel_ratio, self.prescale_cancel), daemon=True)
+		self.prescale_thread.start()
+
+	def stop_prescale(self, wait=True):
+		"""Stop scaling frames in the background. Qt must not be used from it while exiting."""
+		if self.prescale_cancel:
+			self.prescale_cancel.set()
+		if wait and self.prescale_thread:
+			self.prescale_thread.join()
+
+	@tracing.traced("prescale_frames")
+	def prescale_frames(self, frame_indexes, scale, device_pixel_ratio, cancel):
+		for frame_index in frame_indexes:
+			if cancel.is_set():
+				return
+
+			key = (frame_index, scale, device_pixel_ratio)
+			with self.lock:
+				if key in self.images:
+					continue
+
+			if not self.insert(key, self.scale_frame(frame_index, scale, device_pixel_ratio), evict=False):
+				return
+
+class ChatIndex:
+	"""Incremental SQLite FTS5 index over saved chat sessions."""
+	def __init__(self, db_path):
+		os.makedirs(os.path.dirname(db_path), exist_ok=True)
+		self.connection = sqlite3.connect(db_path)
+
+		# message_meta maps each FTS row back to its chat file so a file can be re-indexed on its own.
+		self.connection.executescript("""
+			CREATE TABLE IF NOT EXISTS chats (path TEXT PRIMARY KEY, mtime REAL);
+			CREATE TABLE IF NOT EXISTS message_meta (id INTEGER PRIMARY KEY, path TEXT, position INTEGER, role TEXT);
+			CREATE INDEX IF NOT EXISTS message_meta_path ON message_meta (path);
+			CREATE VIRTUAL TABLE IF NOT EXISTS messages USING fts5(content);
+		""")
+
+	def index_chat(self, path, chat_history):
+		"""(Re)index every message of a chat that was just written to path."""
+		path = os.path.abspath(path)
+		mtime = os.path.getmtime(path)
+
+		with self.connection:
+			self.connection.execute("DELETE FROM messages WHERE rowid IN (SELECT id FROM message_meta WHERE path = ?)", (path,))
+			self.connection.execute("DELETE FROM message_meta WHERE path = ?", (path,))
+
+			for position, msg in enumerate(chat_history.get("exchanges", [])):
+				cursor = self.connection.execute("INSERT INTO message_meta (path, position, role) VALUES (?, ?, ?)", (path, position, msg.get("role", "assistant")))
+				self.connection.execute("INSERT INTO messages (rowid, content) VALUES (?, ?)", (cursor.lastrowid, msg.get("content", "")))
+
+			self.connection.execute("INSERT OR REPLACE INTO chats (path, mtime) VALUES (?, ?)", (path, mtime))
+
+	def add_messages(self, path, start, messages):
+		"""Index messages just appended to the chat at path, the first of them at position start."""
+		path = os.path.abspath(path)
+		mtime = os.path.getmtime(path)
+
+		with self.connection:
+			for position, msg in enumerate(messages, start):
+				cursor = self.connection.execute("INSERT INTO message_meta (path, position, role) VALUES (?, ?, ?)", (path, position, msg.get("role", "assistant")))
+				self.connection.execute("INSERT INTO messages (rowid, content) VALUES (?, ?)", (cursor.lastrowid, msg.get("content", "")))
+
+			self.connection.execute("INSERT OR REPLACE INTO chats (path, mtime) VALUES (?, ?)", (path, mtime))
+
+	def remove_chat(self, path):
+		"""Drop a deleted chat from the index."""
+		path = os.path.abspath(path)
+		with self.connection:
+			self.connection.execute("DELETE FROM messages WHERE rowid IN (SELECT id FROM message_meta WHERE path = ?)", (path,))
+			self.connection.execute("DELETE FROM message_meta WHERE path = ?", (path,))
+			self.connection.execute("DELETE FROM chats WHERE path = ?", (path,))
+
+	def remove_chats_except(self, paths):
+		"""Drop every chat from the index but the ones at paths."""
+		keep = {os.path.abspath(path) for path in paths}
+		for (path,) in self.connection.execute("SELECT path FROM chats").fetchall():
+			if path not in keep:
+				self.remove_chat(path)
+
+	def is_stale(self, path):
+		"""Whether the chat at path changed since it was indexed, or was never indexed."""
+		path = os.path.abspath(path)
+		row = self.connection.execute("SELECT mtime FROM chats WHERE path = ?", (path,)).fetchone()
+		return row is None or row[0] != os.path.getmtime(path)
+
+	def search(self, query, limit=SEARCH_RESULT_LIMIT):
+		"""Return a list of (path, position, role, snippet) for messages matching query."""
+		terms = query.split()
+		if not terms:
+			return []
+
+		# Quote every term so user input can't break FTS syntax, and prefix match the last one while typing.
+		match = " ".join('"' + term.replace('"', '""') + '"' for term in terms) + "*"
+
+		rows = self.connection.execute("""
+			SELECT message_meta.path, message_meta.position, message_meta.role, snippet(messages, 0, '', '', '...', 12)
+			FROM messages JOIN message_meta ON message_meta.id = messages.rowid
+			WHERE messages MATCH ?
+			ORDER BY rank
+			LIMIT ?
+		""", (match, limit))
+		return rows.fetchall()
+
 class ClippyWindow(QWidget):
 	def __init__(self):
 		super().__init__()
@@ -179,15 +1332,33 @@ class ClippyWindow(QWidget):
 		self.setAttribute(Qt.WA_TranslucentBackground)
 		
 		# Load sprite sheet
-		self.sprite_sheet = QPixmap(load_asset("clippy-map.png"))
-		self.sprite_width = 124
-		self.sprite_height = 93
-		self.cols = 27
-		self.rows = 34
-		self.frames = self.extract_frames()
-
-		# Load animations from JSON
-		self.animations = load_animations(load_asset("animations.json"), self.cols)
+		self.sprite_width = SPRITE_WIDTH
+		self.sprite_height = SPRITE_HEIGHT
+		self.cols = SPRITE_COLUMNS
+		self.rows = SPRITE_ROWS
+
+		# Prefer the prebuilt asset pack, then the trimmed atlas, then the sprite sheet.
+		self.asset_pack = load_asset_pack()
+		if self.asset_pack:
+			self.sprite_sheet = self.asset_pack.sheet_image()
+			self.frames = self.asset_pack.frames()
+			self.animations = self.asset_pack.animations()
+		else:
+			atlas = load_atlas(load_asset("clippy-atlas.json"))
+			if atlas:
+				sheet_path = load_asset(atlas["image"])
+				self.frames = [tuple(frame) for frame in atlas["frames"]]
+				frame_map = atlas["cells"]
+			else:
+				sheet_path = load_asset("clippy-map.png")
+				self.frames = self.extract_frames()
+				frame_map = None
+			self.sprite_sheet = QImage(sheet_path).convertToFormat(QImage.Format_ARGB32_Premultiplied)
+
+			# Load animations from JSON
+			self.animations = load_animations(load_asset("animations.json"), self.cols, frame_map)
+		self.frame_cache = ScaledFrameCache(self.sprite_sheet, self.frames)
+
 		if "Idle" not in self.animations:
 			self.animations["Idle"] = [(0, 1000, None)]
 
@@ -195,7 +1366,9 @@ class ClippyWindow(QWidget):
 		self.frame_index = 0
 
 		# Animation timer (will be updated every frame)
+		self.clock = FrameClock()
 		self.timer = QTimer()
+		self.timer.setSingleShot(True)
 		self.timer.timeout.connect(self.next_frame)
 		self.start_current_frame_timer()
 
@@ -205,39 +1378,94 @@ class ClippyWindow(QWidget):
 		self.start_idle_timer()
 
 		# Set window size
+		self.scale = 1
+
+		# (scale, device pixel ratio) frames were last prescaled for. At 1:1 they are drawn straight from the sheet.
+		self.prescaled_for = (1, 1.0)
+		self.screen_change_connected = False
 		self.resize(self.sprite_width, self.sprite_height)
+		if args.scale <= 0:
+			print("Warning: --scale must be greater than 0, using 1")
+		elif args.scale != 1:
+			self.set_scale(args.scale)
 		
 		# For handling mouse dragging
 		self.dragging = False
 		self.offset = None
 
-		# Create sound effects player
-		pygame.mixer.init()
+		# Create sound effects player. Sounds are decoded once, on first use.
+		if self.asset_pack:
+			# Without allowedchanges=0 the mixer may take the device's rate, and packed sounds couldn't be used.
+			pygame.mixer.init(*self.asset_pack.sound_format(), allowedchanges=0)
+		else:
+			pygame.mixer.init()
+		self.sounds = {}
 
 		# Pick a greeting animation at random and play it.
 		greetings = ["Show", "Greeting_1", "Greeting_2"]
 		self.set_animation(greetings[random.randint(0, len(greetings) - 1)])
 
 	def extract_frames(self):
-		"""Extract frames from sprite sheet."""
+		"""Extract frames from sprite sheet as (x, y, width, height, offset_x, offset_y) source rects."""
 		frames = []
 		for row in range(self.rows):
 			for col in range(self.cols):
 				x = col * self.sprite_width
 				y = row * self.sprite_height
-				frame = self.sprite_sheet.copy(x, y, self.sprite_width, self.sprite_height)
-				frames.append(frame)
+				frames.append((x, y, self.sprite_width, self.sprite_height, 0, 0))
 		return frames
 
+	def frame_duration(self):
+		"""Duration in ms of the current frame."""
+		_, duration, _ = self.animations[self.current_animation]["Frames"][self.frame_index]
+		return max(duration, MIN_FRAME_MS)
+
 	def start_current_frame_timer(self):
-		"""Start timer for the current frame's duration."""
+		"""Restart the frame clock at the current frame."""
 		if self.current_animation in self.animations:
-			animation_seq = self.animations[self.current_animation]["Frames"]
-			_, duration, _ = animation_seq[self.frame_index]
-			self.timer.start(max(duration, 10))
+			self.clock.start(self.frame_duration())
+			self.schedule_next_frame()
+
+	def schedule_next_frame(self):
+		"""Wake up when the current frame's deadline is reached."""
+		remaining = max(0, math.ceil(self.clock.remaining_ms()))
 
+		# Coarse timers can be off by 5%, which is most of a short frame.
+		self.timer.setTimerType(Qt.PreciseTimer if remaining < PRECISE_TIMER_THRESHOLD_MS else Qt.CoarseTimer)
+		self.timer.start(remaining)
+
+	@tracing.traced("next_frame")
 	def next_frame(self):
-		"""Advance to the next frame while keeping track of loops and sounds."""
+		"""Advance to the frame that is due now, skipping frames if we fell behind."""
+		if self.current_animation not in self.animations:
+			return
+
+		sound_path = None
+		for _ in range(MAX_FRAME_SKIP + 1):
+			if not self.advance_frame():
+				# A new animation was started and restarted the clock.
+				return
+
+			# Only the last cue of any skipped frames is played.
+			_, _, frame_sound = self.animations[self.current_animation]["Frames"][self.frame_index]
+			if frame_sound:
+				sound_path = frame_sound
+
+			self.clock.advance(self.frame_duration())
+			if self.clock.remaining_ms() > 0:
+				break
+		else:
+			# Hopelessly behind (e.g. after a suspend), carry on from now.
+			self.clock.start(self.frame_duration())
+
+		if sound_path:
+			self.play_sound(sound_path)
+
+		self.update()
+		self.schedule_next_frame()
+
+	def advance_frame(self):
+		"""Step to the next frame while keeping track of loops. Returns False if a different animation was started instead."""
 		if self.current_animation in self.animations:
 			animation_obj = self.animations[self.current_animation]
 			animation_seq = animation_obj["Frames"]
@@ -303,26 +1531,19 @@ class ClippyWindow(QWidget):
 	
 			if not handled_loop and next_index >= len(animation_seq):
 				if hasattr(self, "exiting") and self.exiting:
+					if self.dialog and self.dialog.stuck_threads:
+						self.dialog.exit_now()
 					QApplication.instance().quit()
+					return False
 				elif self.current_animation != "Idle":
 					self.set_animation("Idle")
+					return False
 				else:
 					self.frame_index = 0
 			else:
 				self.frame_index = next_index
-	
-			# Play sound if present
-			frame = animation_seq[self.frame_index]
-			sound_path = None
-			if isinstance(frame, dict):
-				sound_path = frame.get("Sound")
-			elif isinstance(frame, tuple) and len(frame) > 2:
-				sound_path = frame[2]
-			if sound_path:
-				self.play_sound(sound_path)
-	
-			self.update()
-			self.start_current_frame_timer()
+
+		return True
 
 	def set_animation(self, name, loop_controls=None):
 		"""Set the animation."""
@@ -339,9 +1560,16 @@ class ClippyWindow(QWidget):
 		else:
 			print("Warning: Could not find animation", name)
 
+	@tracing.traced("play_sound")
 	def play_sound(self, sound_path):
 		"""Play sound effect."""
-		sound = pygame.mixer.Sound(sound_path)
+		sound = self.sounds.get(sound_path)
+		if sound is None:
+			if self.asset_pack:
+				sound = self.asset_pack.sound(os.path.basename(sound_path))
+			if sound is None:
+				sound = pygame.mixer.Sound(sound_path)
+			self.sounds[sound_path] = sound
 		sound.play()
 
 	def start_idle_timer(self):
@@ -414,6 +1642,10 @@ class ClippyWindow(QWidget):
 		if not self.prompting:
 			self.dialog.show()
 			self.prompting = True
+
+			# Start loading an unloaded local model while the user types.
+			if self.dialog.ai_service == "Local" and not args.no_prewarm:
+				threading.Thread(target=prewarm_llama_instance, args=(self.dialog.model,), daemon=True).start()
 		else:
 			if self.dialog is not None:
 				self.dialog.hide()
@@ -463,6 +1695,54 @@ class ClippyWindow(QWidget):
 	
 		self.move(clippy_new_x, clippy_new_y)
 
+	def set_scale(self, scale):
+		"""Resize Clippy, keeping his feet where they are."""
+		self.scale = scale
+		width = round(self.sprite_width * scale)
+		height = round(self.sprite_height * scale)
+
+		geometry = self.geometry()
+		self.setGeometry(geometry.center().x() - width // 2, geometry.bottom() + 1 - height, width, height)
+		self.adjust_dialog_position()
+
+		self.prescale_for_screen()
+		self.update()
+
+	def prescale_for_screen(self):
+		"""Scale the frames he is most likely to need next for the current scale and screen, while the current one is drawn."""
+		key = (self.scale, self.devicePixelRatioF())
+		if key == self.prescaled_for:
+			return
+
+		self.prescaled_for = key
+		if key != (1, 1.0):
+			self.frame_cache.prescale(self.frames_by_likely_use(), *key)
+		else:
+			self.frame_cache.stop_prescale(wait=False)
+
+	def showEvent(self, event):
+		super().showEvent(event)
+
+		# The device pixel ratio is only known once the window is on a screen, and changes when it moves to another.
+		if not self.screen_change_connected:
+			self.windowHandle().screenChanged.connect(self.screen_changed)
+			self.screen_change_connected = True
+		self.prescale_for_screen()
+
+	def screen_changed(self, screen):
+		self.prescale_for_screen()
+		self.update()
+
+	def frames_by_likely_use(self):
+		"""Frame indexes of the current animation, then Idle, then every other animation."""
+		order = [self.current_animation, "Idle"] + list(self.animations)
+		frame_indexes = {}
+		for name in order:
+			for frame_index, _, _ in self.animations.get(name, {}).get("Frames", []):
+				if frame_index is not None:
+					frame_indexes.setdefault(frame_index, None)
+		return frame_indexes
+
 	def save_chat_history(self):
 		file_path, _ = QFileDialog.getSaveFileName(self, "Save Chat", "", "JSON Files(*.json);;All Files (*)")
 		if file_path:
@@ -482,9 +1762,36 @@ class ClippyWindow(QWidget):
 			try:
 				with open(file_path, 'r') as file:
 					chat_history = json.load(file)
-					self.dialog.set_chat_history(chat_history)
 			except Exception as e:
 				print(f"Failed to load chat: {e}")
+				return
+
+			# The session it opens in is indexed for search.
+			self.dialog.open_chat_file(file_path, chat_history=chat_history)
+
+	def search_chat_helper(self):
+		if not self.prompting:
+			self.toggle_prompt_menu()
+		self.dialog.toggle_search()
+
+	def switch_session_helper(self, session):
+		if not self.prompting:
+			self.toggle_prompt_menu()
+		self.dialog.switch_session(session)
+
+	def new_session_helper(self):
+		if not self.prompting:
+			self.toggle_prompt_menu()
+		self.dialog.new_session()
+
+	def rename_session_helper(self):
+		name, ok = QInputDialog.getText(self, "Rename Session", "Session name:", text=self.dialog.session.name)
+		if ok and name.strip():
+			self.dialog.rename_session(name.strip())
+
+	def delete_session_helper(self):
+		self.set_animation("EmptyTrash")
+		self.dialog.delete_session()
 
 	def reset_chat_helper(self):
 		self.set_animation("EmptyTrash")
@@ -497,8 +1804,15 @@ class ClippyWindow(QWidget):
 		else:
 			print("Error: Could not get file path for a local llm.")
 
+	def connect_to_server(self):
+		current = self.dialog.model if self.dialog.ai_service == "Server" else f"http://{SERVER_DEFAULT_ADDRESS}"
+		url, ok = QInputDialog.getText(self, "Connect to Server", "OpenAI-compatible server URL:", text=current)
+		if ok and url.strip():
+			self.dialog.set_ai_model("Server", url.strip())
+
 	def goodbye(self):
 		"""Pick a random exit animation and then exit."""
+		self.frame_cache.stop_prescale()
 		if self.dialog:
 			self.dialog.shutdown()
 			self.dialog.close()
@@ -507,6 +1821,7 @@ class ClippyWindow(QWidget):
 		self.set_animation(animations[random.randint(0, len(animations) - 1)])
 		self.exiting = True
 
+	@tracing.traced("paintEvent")
 	def paintEvent(self, event):
 		painter = QPainter(self)
 		painter.setRenderHint(QPainter.Antialiasing)
@@ -515,8 +1830,19 @@ class ClippyWindow(QWidget):
 		if self.current_animation in self.animations:
 			animation_seq = self.animations[self.current_animation]["Frames"]
 			frame_index, _, _ = animation_seq[self.frame_index]
-			frame = self.frames[frame_index]
-			painter.drawPixmap(0, 0, frame)
+
+			# Empty atlas cells have no frame.
+			if frame_index is None:
+				return
+
+			x, y, width, height, offset_x, offset_y = self.frames[frame_index]
+			device_pixel_ratio = self.devicePixelRatioF()
+			if self.scale == 1 and device_pixel_ratio == 1:
+				painter.drawImage(offset_x, offset_y, self.sprite_sheet, x, y, width, height)
+			else:
+				# Already scaled to device pixels, so drawing it is a plain copy.
+				image = self.frame_cache.get(frame_index, self.scale, device_pixel_ratio)
+				painter.drawImage(QPointF(offset_x * self.scale, offset_y * self.scale), image)
 
 	def keyPressEvent(self, event):
 		if event.key() == Qt.Key_Escape:
@@ -554,8 +1880,41 @@ class ClippyWindow(QWidget):
 
 		save_chat_action = QAction("Save Chat", self)
 		load_chat_action = QAction("Load Chat", self)
+		search_chat_action = QAction("Search Chats", self)
 		reset_chat_action = QAction("Reset Chat", self)
 
+		# Submenu for conversations
+		sessions_menu = QMenu("Sessions", self)
+		for session in self.dialog.sessions:
+			label = session.name
+			if session.generating:
+				label += " (replying...)"
+			elif session.unread:
+				label += " (new)"
+			session_action = QAction(f"• {label}" if session is self.dialog.session else label, self)
+			session_action.triggered.connect(lambda checked=False, session=session: self.switch_session_helper(session))
+			sessions_menu.addAction(session_action)
+		sessions_menu.addSeparator()
+
+		new_session_action = QAction("New Session", self)
+		rename_session_action = QAction("Rename Session", self)
+		delete_session_action = QAction("Delete Session", self)
+		new_session_action.triggered.connect(self.new_session_helper)
+		rename_session_action.triggered.connect(self.rename_session_helper)
+		delete_session_action.triggered.connect(self.delete_session_helper)
+		sessions_menu.addAction(new_session_action)
+		sessions_menu.addAction(rename_session_action)
+		sessions_menu.addAction(delete_session_action)
+
+		# Submenu for Clippy's size
+		size_menu = QMenu("Size", self)
+		scales = sorted(set(SCALE_FACTORS) | {self.scale})
+		for scale in scales:
+			label = f"{scale * 100:g}%"
+			scale_action = QAction(f"• {label}" if scale == self.scale else label, self)
+			scale_action.triggered.connect(lambda checked=False, scale=scale: self.set_scale(scale))
+			size_menu.addAction(scale_action)
+
 		# Submenu for AI settings
 		ai_settings_menu = QMenu("AI Settings", self)
 
@@ -564,41 +1923,55 @@ class ClippyWindow(QWidget):
 			local_action = QAction("Local", self)
 			openai_action = QAction("• OpenAI", self)
 			openrouter_action = QAction("OpenRouter", self)
+			server_action = QAction("Server", self)
 		elif self.dialog.ai_service == "OpenRouter":
 			local_action = QAction("Local", self)
 			openai_action = QAction("OpenAI", self)
 			openrouter_action = QAction("• OpenRouter", self)
+			server_action = QAction("Server", self)
 		elif self.dialog.ai_service == "Local":
 			local_action = QAction("• Local", self)
 			openai_action = QAction("OpenAI", self)
 			openrouter_action = QAction("OpenRouter", self)
+			server_action = QAction("Server", self)
+		elif self.dialog.ai_service == "Server":
+			local_action = QAction("Local", self)
+			openai_action = QAction("OpenAI", self)
+			openrouter_action = QAction("OpenRouter", self)
+			server_action = QAction("• Server", self)
 
 		# Assign functions to actions
 		prompt_action.triggered.connect(self.toggle_prompt_menu)
 		animate_action.triggered.connect(self.play_random_animation)
 		save_chat_action.triggered.connect(self.save_chat_history)
 		load_chat_action.triggered.connect(self.load_chat_history)
+		search_chat_action.triggered.connect(self.search_chat_helper)
 		reset_chat_action.triggered.connect(self.reset_chat_helper)
 		openai_action.triggered.connect(lambda: self.dialog.set_ai_model("OpenAI", "gpt-4o-mini"))
 		openrouter_action.triggered.connect(lambda: self.dialog.set_ai_model("OpenRouter", "deepseek/deepseek-chat-v3-0324:free"))
 		local_action.triggered.connect(self.load_local_llm)
+		server_action.triggered.connect(self.connect_to_server)
 		exit_action.triggered.connect(self.goodbye)
 
 		# Add actions to chat settings submenu
 		chat_settings_menu.addAction(save_chat_action)
 		chat_settings_menu.addAction(load_chat_action)
+		chat_settings_menu.addAction(search_chat_action)
 		chat_settings_menu.addAction(reset_chat_action)
 
 		# Add actions to AI settings submenu
 		ai_settings_menu.addAction(local_action)
 		ai_settings_menu.addAction(openai_action)
 		ai_settings_menu.addAction(openrouter_action)
+		ai_settings_menu.addAction(server_action)
 
 		# Add actions to main menu
 		menu.addAction(prompt_action)
 		menu.addAction(animate_action)
+		menu.addMenu(sessions_menu)
 		menu.addMenu(chat_settings_menu)
 		menu.addMenu(ai_settings_menu)
+		menu.addMenu(size_menu)
 		menu.addAction(exit_action)
 
 		# Display menu at mouse click location
@@ -615,17 +1988,22 @@ class DialogBox(QDialog):
 		self.active_threads = []
 		self.active_workers = []
 
+		# Workers that didn't stop when exiting. They keep the process from exiting normally.
+		self.stuck_threads = []
+
+		# Bumped whenever the chat view is replaced, so stale history renders are dropped.
+		self.render_generation = 0
+
+		# Release the local model when it sits unused.
+		if args.idle_unload > 0:
+			self.idle_unload_timer = QTimer(self)
+			self.idle_unload_timer.timeout.connect(lambda: unload_idle_llama_instance(args.idle_unload * 60))
+			self.idle_unload_timer.start(IDLE_CHECK_INTERVAL_MS)
+
 		self.default_system_message = "You are a paperclip named Clippy. Your job is to assist the user. You use markdown."
 
 		# Default AI Settings
-		if args.local:
-			self.set_ai_model("Local", args.local)
-		elif args.openrouter:
-			self.set_ai_model("OpenRouter", args.openrouter)
-		elif args.openai:
-			self.set_ai_model("OpenAI", args.openai)
-		else:
-			self.set_ai_model("OpenAI", "gpt-4o-mini")
+		self.set_ai_model(*default_ai_model())
 
 		# Window Styling
 		self.setWindowFlags(Qt.FramelessWindowHint | Qt.Tool)
@@ -647,25 +2025,68 @@ class DialogBox(QDialog):
 		size_grip = QSizeGrip(self)
 		layout.addWidget(size_grip, 0, Qt.AlignTop| Qt.AlignLeft)
 
-		# Web Engine settings
-		self.label = QWebEngineView()
-		self.label.setAttribute(Qt.WA_TranslucentBackground)
-		self.label.setPage(ExternalLinkPage(self.label))
-		self.label.setContextMenuPolicy(Qt.ContextMenuPolicy.NoContextMenu)
-		self.label.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
-
-		# More specific Web Engine settings.
-		engine_settings = self.label.page().settings()
-		engine_settings.setAttribute(QWebEngineSettings.JavascriptCanOpenWindows, False)
-		engine_settings.setAttribute(QWebEngineSettings.JavascriptCanAccessClipboard, False)
-		engine_settings.setAttribute(QWebEngineSettings.PluginsEnabled, False)
-		engine_settings.setAttribute(QWebEngineSettings.WebGLEnabled, False)
-		engine_settings.setAttribute(QWebEngineSettings.Accelerated2dCanvasEnabled, False)
+		# Chat transcript
+		if args.light_ui:
+			self.chat_view = TextChatView(LIGHT_CHAT_CSS, CHAT_WINDOW_MESSAGES, CHAT_MESSAGE_BATCH)
+		else:
+			self.chat_view = WebChatView(CHAT_CSS, load_asset("loading.gif"), CHAT_WINDOW_MESSAGES, CHAT_MESSAGE_BATCH)
+		self.chat_view.internal_link.connect(self.handle_internal_link)
 
 		spacer = QSpacerItem(0, 10, QSizePolicy.Minimum, QSizePolicy.Fixed)
 
-		# Set chat to initial state
-		self.reset_chat()
+		# Document retrieval.
+		self.doc_index = None
+		if args.docs:
+			embedding_model = args.embedding_model or args.local
+			if embedding_model:
+				docs_key = hashlib.sha1(os.path.abspath(args.docs).encode()).hexdigest()[:16]
+				index_dir = os.path.join(QStandardPaths.writableLocation(QStandardPaths.AppDataLocation), "doc-index", docs_key)
+				self.doc_index = DocIndex(args.docs, embedding_model, index_dir)
+
+				# Build the index in the background so the first prompt doesn't pay for it.
+				threading.Thread(target=self.refresh_doc_index, daemon=True).start()
+			else:
+				print("Warning: --docs needs --embedding-model or --local to embed documents.")
+
+		# Full-text index over saved chats.
+		try:
+			self.chat_index = ChatIndex(os.path.join(QStandardPaths.writableLocation(QStandardPaths.AppDataLocation), "chat-index.sqlite3"))
+		except Exception as e:
+			print(f"Warning: Chat search is unavailable: {e}")
+			self.chat_index = None
+
+		# Search box and results, hidden until searching.
+		self.search_field = QLineEdit()
+		self.search_field.setPlaceholderText("Search saved chats...")
+		self.search_field.setStyleSheet("""
+			background: rgba(255, 255, 255, 0.8);
+			border: 1px solid #aaa;
+			border-radius: 5px;
+			padding: 4px;
+			font-size: 10pt;
+		""")
+		self.search_field.textChanged.connect(self.search_chats)
+		self.search_field.hide()
+
+		self.search_results = QListWidget()
+		self.search_results.setStyleSheet("""
+			background: rgba(255, 255, 255, 0.8);
+			border: 1px solid #aaa;
+			font-size: 9pt;
+		""")
+		self.search_results.setWordWrap(True)
+		# Activated by a click or double click, depending on the platform, or Enter.
+		self.search_results.itemActivated.connect(self.open_search_result)
+		self.search_results.hide()
+
+		# Open the most recently used conversation, or start one.
+		self.sessions_dir = os.path.join(QStandardPaths.writableLocation(QStandardPaths.AppDataLocation), "sessions")
+		self.sessions = load_sessions(self.sessions_dir, self.chat_index)
+		self.session = None
+		if self.sessions:
+			self.switch_session(max(self.sessions, key=lambda session: os.path.getmtime(session.path)))
+		else:
+			self.new_session()
 
 		# Input field
 		self.input_field = QLineEdit()
@@ -679,7 +2100,9 @@ class DialogBox(QDialog):
 		""")
 		self.input_field.returnPressed.connect(self.handle_input)
 
-		layout.addWidget(self.label)
+		layout.addWidget(self.search_field)
+		layout.addWidget(self.search_results)
+		layout.addWidget(self.chat_view)
 		layout.addItem(spacer)
 		layout.addWidget(self.input_field)
 		self.setLayout(layout)
@@ -690,66 +2113,11 @@ class DialogBox(QDialog):
 		self.model = model
 		
 		# Pick a api key.
-		if service == "OpenAI":
-			self.api_key = os.getenv("OPENAI_API_KEY", "").strip()
-		elif service == "OpenRouter":
-			self.api_key = os.getenv("OPENROUTER_API_KEY", "").strip()
-		elif service == "Local":
-			self.api_key = ""
-		else:
+		if service not in ("OpenAI", "OpenRouter", "Local", "Server"):
 			print(f"Warning: Unknown AI service: {service}")
+		self.api_key = get_api_key(service)
 		
 
-	def generate_html(self, message):
-		"""Generate full HTML structure for displaying messages."""
-		return f"""
-		<html>
-			<head>
-				<style>
-					body {{
-						font-size: 10pt;
-						background-color: rgb(255, 255, 204);
-						overflow-y: scroll;
-						overflow-wrap: break-word;
-						max-height: 100vh;
-					}}
-					.message {{
-						padding: 5px;
-						border-radius: 5px;
-						margin-bottom: 5px;
-					}}
-					.user {{
-						text-align: right;
-						font-style: italic;
-					}}
-					.bot {{
-						text-align: left;
-					}}
-					.codehilite pre {{
-						overflow-x: auto;
-						white-space: pre;
-						display: block;
-						max-width: 100%;
-					}}
-					.codehilite code {{
-						display: block;
-						overflow-x: auto;
-						white-space: pre;
-						background-color: #f8f8f8;
-						padding: 5px;
-						border-radius: 5px;
-					}}
-				</style>
-			</head>
-			<body>
-				{message}
-				<script>
-				window.scrollTo(0, document.body.scrollHeight);
-				</script>
-			</body>
-		</html>
-		"""
-
 	def handle_input(self):
 		input_text = self.input_field.text()
 
@@ -761,46 +2129,33 @@ class DialogBox(QDialog):
 		safe_text = html.escape(input_text)
 
 		# Update UI
-		self.label.page().runJavaScript(f"""
-			var chatWindow = document.body;
-			var newMessage = document.createElement('div');
-			newMessage.className = "message user";
-			newMessage.innerHTML = "{safe_text}";
-			chatWindow.appendChild(newMessage);
-			window.scrollTo(0, document.body.scrollHeight);
-		""")
+		self.chat_view.add_message(safe_text, "message user")
 
 		# Display loading message
-		gif_base64 = self.get_base64_gif(load_asset("loading.gif"))
-		loading_html = f"""
-			var loadingMessage = document.createElement('div');
-			loadingMessage.id = "loading";
-			loadingMessage.className = "message bot";
-		
-			var img = document.createElement('img');
-			img.src = "data:image/gif;base64,{gif_base64}";
-			img.alt = "Loading...";
-			img.style.display = "block";
-		
-			loadingMessage.appendChild(img);
-			document.body.appendChild(loadingMessage);
-			window.scrollTo(0, document.body.scrollHeight);
-		"""
-		
-		self.label.page().runJavaScript(loading_html)
+		self.chat_view.add_message(self.chat_view.loading_html(), "message bot", "loading")
+
+		# Create worker. It gets a copy of the history, which keeps growing while it runs.
+		history = {"exchanges": list(self.chat_history["exchanges"])}
+		worker = ChatWorker(input_text, self.default_system_message, history, self.api_key, self.model, self.ai_service, self.doc_index, self.session.id)
+		worker.finished.connect(self.display_bot_response)
+		worker.error.connect(self.display_chat_error)
+		self.session.generating += 1
+		self.start_worker(worker)
+
+		self.input_field.clear()
 
-		# Create thread and worker
+	def start_worker(self, worker):
+		"""Run a worker on its own thread until it emits finished or error."""
 		thread = QThread()
-		worker = ChatWorker(input_text, self.default_system_message, self.chat_history, self.api_key, self.model, self.ai_service)
 		worker.moveToThread(thread)
 		
 		# Maintain reference
 		self.active_threads.append(thread)
 		self.active_workers.append(worker)
 		
-		# Connect signals
-		worker.finished.connect(self.display_bot_response)
-		worker.error.connect(self.display_error)
+		# Stop the thread once the worker is done
+		worker.finished.connect(thread.quit)
+		worker.error.connect(thread.quit)
 		
 		def on_finished_or_error():
 			thread.quit()
@@ -816,45 +2171,64 @@ class DialogBox(QDialog):
 		thread.started.connect(worker.run)
 		thread.start()
 
-		self.input_field.clear()
-
+	@property
+	def chat_history(self):
+		"""History of the current session."""
+		return self.session.chat_history
+
+	def find_session(self, session_id):
+		for session in self.sessions:
+			if session.id == session_id:
+				return session
+		return None
+
+	def find_session_by_path(self, path):
+		"""The session saved at path, for search hits."""
+		for session in self.sessions:
+			if os.path.abspath(session.path) == path:
+				return session
+		return None
+
+	def display_bot_response(self, session_id, prompt, md_reply, html_reply):
+		session = self.find_session(session_id)
+		if session is None:
+			# Deleted while it was generating.
+			return
 
-	def display_bot_response(self, prompt, md_reply):
-		self.chat_history["exchanges"].append({"role": "user", "content": prompt})
-		self.chat_history["exchanges"].append({"role": "assistant", "content": md_reply})
+		session.generating -= 1
+		session.append({"role": "user", "content": prompt}, {"role": "assistant", "content": md_reply})
+		self.show_in_session(session, html_reply, scroll_to_start=True)
 
-		html_reply = markdown.markdown(md_reply, extensions=[ExtraExtension(), CodeHiliteExtension(noclasses=True), FencedCodeExtension(), TocExtension(baselevel=2)])
-		safe_html = html_reply.replace("\\", "\\\\").replace('"', '\\"').replace("'", "\\'").replace("`", "\\`").replace("\n", "\\n").replace("{", "\\{").replace("}", "\\}").replace("$", "\\$")
+	def display_chat_error(self, session_id, error_msg):
+		session = self.find_session(session_id)
+		if session is None:
+			return
 
-		self.label.page().runJavaScript(f"""
-			var loading = document.getElementById('loading');
-			if (loading) loading.remove();
-	
-			var response = document.createElement('div');
-			response.className = "message bot";
-			response.innerHTML = `{safe_html}`;
-			document.body.appendChild(response);
-			response.scrollIntoView({{ behavior: "smooth", block: "start" }});
-		""")
+		session.generating -= 1
+		if session is self.session:
+			self.display_error(error_msg)
+		else:
+			print(f"[ERROR] {error_msg}")
+			self.show_in_session(session, f"Error: {html.escape(error_msg)}")
+
+	def show_in_session(self, session, message_html, scroll_to_start=False):
+		"""Show a reply in the chat view, or keep it for when a background session is opened again."""
+		if session is not self.session:
+			if session.messages_html is not None:
+				session.messages_html.append(f"<div class='message bot'>{message_html}</div>")
+			session.unread = True
+		elif session.messages_html is None:
+			# Still rendering the history, which is missing the reply.
+			self.render_session()
+		else:
+			self.chat_view.remove_message("loading")
+			self.chat_view.add_message(message_html, "message bot", scroll_to_start=scroll_to_start)
 
 	def display_error(self, error_msg):
 		print(f"[ERROR] {error_msg}")
 
-		self.label.page().runJavaScript(f"""
-			var loading = document.getElementById('loading');
-			if (loading) loading.remove();
-	
-			var errorDiv = document.createElement('div');
-			errorDiv.className = "message bot";
-			errorDiv.innerHTML = "Error: {html.escape(error_msg)}";
-			document.body.appendChild(errorDiv);
-			window.scrollTo(0, document.body.scrollHeight);
-		""")
-
-	def get_base64_gif(self, path):
-		with open(path, "rb") as f:
-			data = f.read()
-			return base64.b64encode(data).decode("utf-8")
+		self.chat_view.remove_message("loading")
+		self.chat_view.add_message(f"Error: {html.escape(error_msg)}", "message bot")
 
 	def reset_chat(self):
 		# Pick greeting message
@@ -862,48 +2236,199 @@ class DialogBox(QDialog):
 		self.greeting = random.choice(self.greetings)
 
 		# Reset chat history
-		self.chat_history = {"exchanges": [{"role": "assistant", "content": self.greeting}]}
+		self.session.chat_history = {"exchanges": [{"role": "assistant", "content": self.greeting}]}
+		self.session.save()
+		self.render_generation += 1
 
 		# Reset html
 		self.greeting_html = f"<div class='message bot'>{self.greeting}</div>"
-		self.label.setHtml(self.generate_html(self.greeting_html))
+		self.show_session_messages([self.greeting_html])
+
+	def new_session(self, name=None, chat_history=None, position=None, source=None):
+		"""Start a conversation, empty or with chat_history, and switch to it. source is the chat file it came from."""
+		if name is None:
+			names = {session.name for session in self.sessions}
+			number = 1
+			while f"Chat {number}" in names:
+				number += 1
+			name = f"Chat {number}"
+
+		session = ChatSession(os.path.join(self.sessions_dir, f"{uuid.uuid4().hex}.jsonl"), name, source=source, chat_index=self.chat_index)
+		self.sessions.append(session)
+		self.session = session
+
+		if chat_history is None:
+			self.reset_chat()
+		else:
+			session.chat_history = {"exchanges": list(chat_history.get("exchanges", []))}
+			session.save()
+			self.render_session(position)
+
+	def open_chat_file(self, path, position=None, chat_history=None):
+		"""Open a saved chat file in a session, reusing the one it was opened in before."""
+		path = os.path.abspath(path)
+		for session in self.sessions:
+			if session.source == path:
+				self.switch_session(session, position)
+				return
+
+		if chat_history is None:
+			try:
+				with open(path, 'r') as file:
+					chat_history = json.load(file)
+			except Exception as e:
+				print(f"Failed to load chat: {e}")
+				return
 
-	def set_chat_history(self, chat_history):
-		# Set chat history
-		self.chat_history = chat_history
+		self.new_session(os.path.basename(path), chat_history, position, source=path)
 
-		# Set html	
-		messages_html = ""
-		for msg in self.chat_history.get("exchanges", []):
-			role = msg.get("role", "assistant")
-			content = msg.get("content", "")
-	
-			if role == "assistant":
-				# Render Markdown to HTML for assistant messages
-				md_html = markdown.markdown(
-					content,
-					extensions=[ExtraExtension(), CodeHiliteExtension(noclasses=True), FencedCodeExtension(), TocExtension(baselevel=2)]
-				)
-				message_html = f"<div class='message bot'>{md_html}</div>"
-			else:
-				# Escape and render user message as-is
-				safe_text = html.escape(content)
-				message_html = f"<div class='message user'>{safe_text}</div>"
-	
-			messages_html += message_html
-	
-		full_html = self.generate_html(messages_html)
-		self.label.setHtml(full_html)
+	def switch_session(self, session, position=None):
+		"""Show another conversation, scrolled to message position if given. Replies still being generated for the last one keep going."""
+		if session is self.session and position is None:
+			return
+
+		self.session = session
+		session.unread = False
+		session.load()
+
+		if session.messages_html is not None:
+			self.render_generation += 1
+			self.show_session_messages(session.messages_html, position)
+		else:
+			self.render_session(position)
+
+	def rename_session(self, name):
+		self.session.name = name
+		self.session.save()
+
+	def delete_session(self):
+		"""Delete the current conversation and switch to the previous one."""
+		session = self.session
+		self.stop_generation()
+		self.sessions.remove(session)
+		session.delete()
+
+		self.session = None
+		if self.sessions:
+			self.switch_session(self.sessions[-1])
+		else:
+			self.new_session()
+
+	def render_session(self, position=None):
+		# Render the html off the GUI thread
+		self.render_generation += 1
+		self.session.messages_html = None
+		worker = RenderWorker(list(self.chat_history.get("exchanges", [])), self.render_generation, -1 if position is None else position)
+		worker.finished.connect(self.display_chat_history)
+		worker.error.connect(self.display_error)
+		self.start_worker(worker)
+
+	def display_chat_history(self, generation, messages_html, position):
+		# A newer chat replaced this one while it was rendering.
+		if generation != self.render_generation:
+			return
+
+		self.show_session_messages(messages_html, position if position >= 0 else None)
+
+	def show_session_messages(self, messages_html, position=None):
+		self.chat_view.show_messages(messages_html, position)
+
+		# The session's render cache is the view's own list, so it keeps up with new messages.
+		self.session.messages_html = self.chat_view.messages
+		if self.session.generating:
+			self.chat_view.add_message(self.chat_view.loading_html(), "message bot", "loading")
+
+	def refresh_doc_index(self):
+		try:
+			self.doc_index.refresh()
+		except Exception as e:
+			print(f"Failed to index documents: {e}")
+
+	def toggle_search(self):
+		"""Show / Hide the saved chat search box."""
+		if self.search_field.isVisible():
+			self.search_field.hide()
+			self.search_results.hide()
+			self.input_field.setFocus()
+		else:
+			self.search_field.show()
+			self.search_field.setFocus()
+			self.search_chats(self.search_field.text())
+
+	def search_chats(self, query):
+		"""List saved messages matching query."""
+		self.search_results.clear()
+		if self.chat_index is None:
+			return
+
+		try:
+			results = self.chat_index.search(query)
+		except sqlite3.Error as e:
+			print(f"Search failed: {e}")
+			results = []
+
+		for path, position, role, snippet in results:
+			who = "You" if role == "user" else "Clippy"
+			session = self.find_session_by_path(path)
+			title = session.name if session is not None else os.path.basename(path)
+			item = QListWidgetItem(f"{title} - {who}: {' '.join(snippet.split())}")
+			item.setData(Qt.UserRole, (path, position))
+			self.search_results.addItem(item)
+
+		self.search_results.setVisible(bool(results))
+
+	def open_search_result(self, item):
+		"""Open the conversation a search hit came from, scrolled to the hit."""
+		path, position = item.data(Qt.UserRole)
+		session = self.find_session_by_path(path)
+		if session is not None:
+			self.switch_session(session, position)
+		else:
+			self.open_chat_file(path, position)
+		self.toggle_search()
+
+	def handle_internal_link(self, url):
+		"""Handle clippy: links clicked in the chat."""
+		if url.path() == "stop":
+			self.stop_generation()
+
+	def stop_generation(self, all_sessions=False):
+		"""Cancel the replies still being generated for the current session, or for every session."""
+		for worker in self.active_workers:
+			if isinstance(worker, ChatWorker) and (all_sessions or worker.session_id == self.session.id):
+				worker.cancel()
 
 	def shutdown(self):
-		# Gracefully close all active threads
-		for thread in self.active_threads:
+		# Stop running generations, then give the threads a bounded time to finish
+		self.stop_generation(all_sessions=True)
+
+		deadline = time.monotonic() + SHUTDOWN_TIMEOUT_MS / 1000
+		for thread in list(self.active_threads):
 			thread.quit()
-			thread.wait()
+			remaining = max(0, int((deadline - time.monotonic()) * 1000))
+			if not thread.wait(remaining):
+				# Still stuck in a blocking call. Terminating it could leave locks held or memory corrupt, so exit_now() leaves it behind instead.
+				print("Warning: Worker thread did not stop in time, exiting without it.")
+				self.stuck_threads.append(thread)
 	
 		self.active_threads.clear()
 		self.active_workers.clear()
 
+	def exit_now(self):
+		"""Save what is left and exit the process at once, leaving stuck workers behind.
+
+		Qt aborts if a thread is still running when it is torn down, so this skips the normal exit."""
+		for session in self.sessions:
+			if session.chat_history is not None:
+				session.save()
+		if self.chat_index is not None:
+			self.chat_index.connection.close()
+		tracing.save()
+
+		sys.stdout.flush()
+		sys.stderr.flush()
+		os._exit(0)
+
 	def paintEvent(self, event):
 		painter = QPainter(self)
 		painter.setRenderHint(QPainter.Antialiasing)
@@ -936,18 +2461,125 @@ class DialogBox(QDialog):
 		if self.parent() and hasattr(self.parent(), "reposition_clippy_from_dialog"):
 			self.parent().reposition_clippy_from_dialog()
 
-class ExternalLinkPage(QWebEnginePage):
-	def acceptNavigationRequest(self, url, nav_type, is_main_frame):
-		if nav_type == QWebEnginePage.NavigationTypeLinkClicked:
+class TextChatView(QTextBrowser):
+	"""Chat transcript in a native rich text widget, for --light-ui. Renders the HTML/CSS subset Qt supports."""
+	internal_link = Signal(QUrl)
+
+	def __init__(self, stylesheet, message_window, message_batch, parent=None):
+		super().__init__(parent)
+		self.message_window = message_window
+		self.message_batch = message_batch
+
+		# Every message of the chat, the range of them shown and temporary (element id, html) messages.
+		self.messages = []
+		self.first = 0
+		self.last = 0
+		self.temporary = []
+
+		self.document().setDefaultStyleSheet(stylesheet)
+		self.setStyleSheet("background-color: rgb(255, 255, 204); border: none; font-size: 10pt;")
+		self.setContextMenuPolicy(Qt.ContextMenuPolicy.NoContextMenu)
+		self.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
+
+		# Handle links the same way as ExternalLinkPage.
+		self.setOpenLinks(False)
+		self.anchorClicked.connect(self.handle_link)
+
+	def handle_link(self, url):
+		if url.scheme() != "clippy":
 			QDesktopServices.openUrl(url)
-			return False
-		return super().acceptNavigationRequest(url, nav_type, is_main_frame)
+		elif url.path() == "older":
+			self.show_older()
+		elif url.path() == "newer":
+			self.show_newer()
+		else:
+			self.internal_link.emit(url)
+
+	def show_messages(self, messages, position=None):
+		"""Replace the transcript with a list of message HTML. Shows the last messages, or the window around position."""
+		self.messages = list(messages)
+		self.temporary = []
+		self.last = len(self.messages)
+		if position is not None:
+			self.last = min(self.last, max(0, position - self.message_window // 2) + self.message_window)
+		self.first = max(0, self.last - self.message_window)
+		self.refresh(f"view-{position}" if position is not None else None)
+
+	def show_older(self):
+		"""Show the batch of messages before the first one shown, keeping the current one in view."""
+		anchor = f"view-{self.first}"
+		self.first = max(0, self.first - self.message_batch)
+		self.refresh(anchor)
+
+	def show_newer(self):
+		"""Show the batch of messages after the last one shown, dropping as many from the start."""
+		anchor = f"view-{self.last - 1}"
+		self.last = min(len(self.messages), self.last + self.message_batch)
+		self.first = max(self.first, self.last - self.message_window)
+		self.refresh(anchor)
+
+	def add_message(self, message_html, css_class, element_id=None, scroll_to_start=False):
+		"""Append a message to the transcript and scroll to it. Messages with an element_id are temporary and not kept."""
+		message_html = f"<div class='{css_class}'>{message_html}</div>"
+		if element_id:
+			self.temporary.append((element_id, message_html))
+		else:
+			# Showing a window in the middle of the chat jumps to the end.
+			at_end = self.last == len(self.messages)
+			self.messages.append(message_html)
+			self.last = len(self.messages)
+			self.first = max(self.first if at_end else 0, self.last - self.message_window)
+		self.refresh(f"view-{len(self.messages) - 1}" if scroll_to_start and not element_id else None)
+
+	def remove_message(self, element_id):
+		"""Remove the message added with element_id, if it is still there."""
+		self.temporary = [(message_id, message_html) for message_id, message_html in self.temporary if message_id != element_id]
+		self.refresh()
+
+	def loading_html(self):
+		"""Placeholder shown while a reply is generated."""
+		return "<i>Thinking...</i> <a href='clippy:stop'>Stop</a>"
+
+	@tracing.traced("TextChatView.setHtml")
+	def refresh(self, anchor=None):
+		parts = []
+		if self.first > 0:
+			parts.append("<p align='center'><a href='clippy:older'>Show earlier messages</a></p>")
+		for i, message_html in enumerate(self.messages[self.first:self.last], self.first):
+			parts.append(f"<a name='view-{i}'></a>{message_html}")
+		if self.last < len(self.messages):
+			parts.append("<p align='center'><a href='clippy:newer'>Show later messages</a></p>")
+		parts.extend(message_html for _, message_html in self.temporary)
+
+		self.setHtml("".join(parts))
+		if anchor:
+			self.scrollToAnchor(anchor)
+		else:
+			self.verticalScrollBar().setValue(self.verticalScrollBar().maximum())
 
-class ChatWorker(QObject):
-	finished = Signal(str, str)
+class RenderWorker(QObject):
+	finished = Signal(int, list, int)
 	error = Signal(str)
 
-	def __init__(self, prompt, system_message, history, api_key, model, service):
+	def __init__(self, exchanges, generation, position):
+		super().__init__()
+		self.exchanges = exchanges
+		self.generation = generation
+		self.position = position
+
+	@Slot()
+	@tracing.traced("RenderWorker.run")
+	def run(self):
+		try:
+			self.finished.emit(self.generation, render_messages(self.exchanges), self.position)
+		except Exception as e:
+			self.error.emit(f"Failed to render chat: {str(e)}")
+
+class ChatWorker(QObject):
+	finished = Signal(str, str, str, str)
+	error = Signal(str, str)
+
+	def __init__(self, prompt, system_message, history, api_key, model, service, doc_index=None, session_id=""):
 		super().__init__()
 		self.prompt = prompt
 		self.system_message = system_message
@@ -955,23 +2587,54 @@ class ChatWorker(QObject):
 		self.api_key = api_key
 		self.model = model
 		self.ai_service = service
+		self.doc_index = doc_index
+		self.session_id = session_id
+		self.cancel_token = CancelToken()
+
+	def cancel(self):
+		"""Stop generating. Safe to call from any thread."""
+		self.cancel_token.cancel()
+
+	def retrieve_context(self):
+		"""Look up document excerpts relevant to the prompt."""
+		if self.doc_index is None:
+			return None
+
+		try:
+			return self.doc_index.retrieve(self.prompt)
+		except Exception as e:
+			print(f"Document retrieval failed: {e}")
+			return None
 
 	@Slot()
+	@tracing.traced("ChatWorker.run")
 	def run(self):
 		try:
-			response = prompt_ai(self.prompt, self.system_message, self.history, self.api_key, self.model, self.ai_service)
+			context = self.retrieve_context()
+			response = prompt_ai(self.prompt, self.system_message, self.history, self.api_key, self.model, self.ai_service, context, self.cancel_token)
 			if "error" in response:
-				self.error.emit(response["error"])
+				self.error.emit(self.session_id, response["error"])
 			elif "choices" in response and response["choices"]:
 				md_reply = response["choices"][0]["message"]["content"]
-				self.finished.emit(self.prompt, md_reply)
+				html_reply = render_markdown(md_reply)
+				if response.get("cancelled"):
+					if not md_reply:
+						self.error.emit(self.session_id, "Generation stopped.")
+						return
+					html_reply += "<p><i>(Stopped)</i></p>"
+				self.finished.emit(self.session_id, self.prompt, md_reply, html_reply)
 			else:
-				self.error.emit("Unexpected API response format.")
+				self.error.emit(self.session_id, "Unexpected API response format.")
 		except Exception as e:
-			self.error.emit(f"Unhandled exception in worker: {str(e)}")
+			self.error.emit(self.session_id, f"Unhandled exception in worker: {str(e)}")
 
 if __name__ == '__main__':
+	if args.serve:
+		serve(args.serve)
+		sys.exit(0)
+
 	app = QApplication(sys.argv)
+	app.setApplicationName("clippy-gpt")
 	window = ClippyWindow()
 	window.show()
 	sys.exit(app.exec())
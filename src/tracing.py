@@ -0,0 +1,76 @@
+"""Opt-in span tracing for --trace.
+
+Spans are recorded as Chrome trace events with the thread they ran on and
+written to a JSON file at exit, which can be opened in Perfetto or
+chrome://tracing. Until start() is called, traced() returns functions
+unchanged, so tracing costs nothing when it is off.
+"""
+
+import os
+import json
+import time
+import atexit
+import threading
+import functools
+
+_events = None
+_path = None
+_named_threads = set()
+_lock = threading.Lock()
+
+def start(path):
+	"""Start recording spans, to be written to path when the program exits."""
+	global _events, _path
+	_events = []
+	_path = path
+	atexit.register(save)
+
+def _timestamp_us():
+	return time.perf_counter_ns() / 1000
+
+def _name_thread(span_name):
+	"""Label the current thread's track the first time a span starts on it."""
+	tid = threading.get_native_id()
+	if tid in _named_threads:
+		return
+
+	thread = threading.current_thread()
+	# Threads started by Qt are unknown to Python, name them after the first thing they ran.
+	thread_name = span_name if isinstance(thread, threading._DummyThread) else thread.name
+	with _lock:
+		if tid not in _named_threads:
+			_named_threads.add(tid)
+			_events.append({"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid, "args": {"name": thread_name}})
+
+def _record(name, start_us, end_us):
+	_events.append({"name": name, "ph": "X", "ts": start_us, "dur": end_us - start_us, "pid": os.getpid(), "tid": threading.get_native_id()})
+
+def traced(name):
+	"""Decorator recording a span for every call. Must be applied after start() to have any effect."""
+	def decorate(function):
+		if _events is None:
+			return function
+
+		@functools.wraps(function)
+		def wrapper(*call_args, **call_kwargs):
+			_name_thread(name)
+			start_us = _timestamp_us()
+			try:
+				return function(*call_args, **call_kwargs)
+			finally:
+				_record(name, start_us, _timestamp_us())
+		return wrapper
+	return decorate
+
+def save():
+	"""Write the recorded spans to the trace file."""
+	if _events is None:
+		return
+
+	events = list(_events)
+	try:
+		with open(_path, "w", encoding="utf-8") as f:
+			json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+		print(f"Wrote {len(events)} trace events to {_path}")
+	except OSError as e:
+		print(f"Failed to write trace {_path}: {e}")
@@ -0,0 +1,313 @@
+"""QtWebEngine chat view for Clippy's dialog box.
+
+This lives apart from main.py so that --light-ui never imports QtWebEngine.
+It has to be imported before the QApplication is created, and every view
+starts a Chromium renderer process.
+"""
+
+import re
+import json
+import base64
+import tracing
+from PySide6.QtCore import Qt, Signal, QUrl, QUrlQuery
+from PySide6.QtGui import QDesktopServices
+from PySide6.QtWidgets import QSizePolicy
+from PySide6.QtWebEngineWidgets import QWebEngineView
+from PySide6.QtWebEngineCore import QWebEnginePage, QWebEngineSettings
+
+class ExternalLinkPage(QWebEnginePage):
+	internal_link = Signal(QUrl)
+
+	def acceptNavigationRequest(self, url, nav_type, is_main_frame):
+		if url.scheme() == "clippy":
+			self.internal_link.emit(url)
+			return False
+		if nav_type == QWebEnginePage.NavigationTypeLinkClicked:
+			QDesktopServices.openUrl(url)
+			return False
+		return super().acceptNavigationRequest(url, nav_type, is_main_frame)
+
+# Keeps only a window of messages in the DOM. The ones before and after it are stood
+# in for by spacers of their estimated height, and requested from Python
+# (clippy:older, clippy:newer) when they scroll into view. Messages scrolled far
+# past are dropped again.
+WINDOW_SCRIPT = """
+var messageWindow = %(window)d;
+var sizes = %(sizes)s;
+var first = %(first)d;
+var last = %(last)d;
+var measured = {};
+var requestingOlder = false;
+var requestingNewer = false;
+var lastScrollY = window.scrollY;
+var spacer = document.getElementById('older-spacer');
+var newerSpacer = document.getElementById('newer-spacer');
+
+function estimateHeight(index) {
+	if (index in measured) return measured[index];
+	var charsPerLine = Math.max(document.body.clientWidth / 7, 10);
+	return (Math.ceil(sizes[index][0] / charsPerLine) + sizes[index][1]) * 15 + 15;
+}
+
+function updateSpacers() {
+	var height = 0;
+	for (var i = 0; i < first; i++) height += estimateHeight(i);
+	spacer.style.height = height + 'px';
+
+	height = 0;
+	for (var i = last; i < sizes.length; i++) height += estimateHeight(i);
+	newerSpacer.style.height = height + 'px';
+}
+
+function makeItem(index, html) {
+	var item = document.createElement('div');
+	item.className = 'chat-item';
+	item.dataset.index = index;
+	item.innerHTML = html;
+	return item;
+}
+
+function trimOlder() {
+	// Only while moving down the chat, and only what is above the viewport,
+	// so the spacer grows by exactly what was removed and nothing moves.
+	var items = document.querySelectorAll('.chat-item');
+	var removed = false;
+	for (var i = 0; i < items.length - messageWindow; i++) {
+		if (items[i].getBoundingClientRect().bottom > 0) break;
+		measured[first] = items[i].offsetHeight;
+		items[i].remove();
+		first++;
+		removed = true;
+	}
+	if (removed) updateSpacers();
+}
+
+function trimNewer() {
+	// Only while moving up the chat, and only what is below the viewport.
+	var items = document.querySelectorAll('.chat-item');
+	var removed = false;
+	for (var i = items.length - 1; i >= messageWindow; i--) {
+		if (items[i].getBoundingClientRect().top < window.innerHeight) break;
+		measured[last - 1] = items[i].offsetHeight;
+		items[i].remove();
+		last--;
+		removed = true;
+	}
+	if (removed) updateSpacers();
+}
+
+function requestOlder() {
+	if (requestingOlder || first == 0) return;
+	if (window.scrollY > spacer.offsetHeight + window.innerHeight) return;
+	requestingOlder = true;
+	window.location.href = 'clippy:older?before=' + first;
+}
+
+function requestNewer() {
+	if (requestingNewer || last >= sizes.length) return;
+	if (window.scrollY + 2 * window.innerHeight < newerSpacer.offsetTop) return;
+	requestingNewer = true;
+	window.location.href = 'clippy:newer?after=' + last;
+}
+
+function prependMessages(start, messages) {
+	requestingOlder = false;
+	// Stale answer for a chat that has since been replaced.
+	if (start + messages.length != first) return;
+
+	var next = spacer.nextSibling;
+	var items = messages.map(function(html, i) { return makeItem(start + i, html); });
+	var estimated = 0;
+	items.forEach(function(item, i) {
+		estimated += estimateHeight(start + i);
+		spacer.parentNode.insertBefore(item, next);
+	});
+	first = start;
+	updateSpacers();
+
+	// Keep what is on screen in place, correcting for the estimates being off.
+	var actual = items.reduce(function(sum, item) { return sum + item.offsetHeight; }, 0);
+	window.scrollBy(0, actual - estimated);
+	requestOlder();
+}
+
+function appendMessages(start, messages) {
+	requestingNewer = false;
+	if (start != last) return;
+
+	// Everything changes below the viewport, so nothing on screen moves.
+	messages.forEach(function(html, i) {
+		newerSpacer.parentNode.insertBefore(makeItem(start + i, html), newerSpacer);
+	});
+	last = start + messages.length;
+	updateSpacers();
+	trimOlder();
+	requestNewer();
+}
+
+function addMessage(html, size, elementId, scrollToStart) {
+	var item;
+	if (elementId) {
+		item = document.createElement('div');
+		item.id = elementId;
+		item.innerHTML = html;
+		document.body.appendChild(item);
+	} else {
+		if (last < sizes.length) {
+			// Showing a window in the middle of the chat. Jump to the end, the
+			// messages before the new one are requested as they scroll into view.
+			document.querySelectorAll('.chat-item').forEach(function(old) { old.remove(); });
+			first = sizes.length;
+		}
+		sizes.push(size);
+		last = sizes.length;
+		item = makeItem(sizes.length - 1, html);
+		newerSpacer.parentNode.insertBefore(item, newerSpacer);
+		updateSpacers();
+	}
+
+	if (scrollToStart) {
+		item.scrollIntoView({ behavior: "smooth", block: "start" });
+	} else {
+		window.scrollTo(0, document.body.scrollHeight);
+	}
+	trimOlder();
+	requestOlder();
+}
+
+window.addEventListener('scroll', function() {
+	if (window.scrollY >= lastScrollY) {
+		trimOlder();
+		requestNewer();
+	} else {
+		trimNewer();
+	}
+	requestOlder();
+	lastScrollY = window.scrollY;
+});
+updateSpacers();
+"""
+
+def message_size(message_html):
+	"""Rough [characters, line breaks] of a message, used to estimate its height before it is shown."""
+	text = re.sub(r"<[^>]*>", "", message_html)
+	return [len(text), text.count("\n")]
+
+class WebChatView(QWebEngineView):
+	"""Chat transcript rendered by QtWebEngine."""
+	internal_link = Signal(QUrl)
+
+	def __init__(self, stylesheet, loading_gif_path, message_window, message_batch, parent=None):
+		super().__init__(parent)
+		self.stylesheet = stylesheet
+		self.message_window = message_window
+		self.message_batch = message_batch
+
+		# Every message of the chat, whether or not it is currently in the DOM.
+		self.messages = []
+
+		with open(loading_gif_path, "rb") as f:
+			self.loading_gif_base64 = base64.b64encode(f.read()).decode("utf-8")
+
+		# Web Engine settings
+		self.setAttribute(Qt.WA_TranslucentBackground)
+		self.setPage(ExternalLinkPage(self))
+		self.page().internal_link.connect(self.handle_link)
+		self.setContextMenuPolicy(Qt.ContextMenuPolicy.NoContextMenu)
+		self.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
+
+		# More specific Web Engine settings.
+		engine_settings = self.page().settings()
+		engine_settings.setAttribute(QWebEngineSettings.JavascriptCanOpenWindows, False)
+		engine_settings.setAttribute(QWebEngineSettings.JavascriptCanAccessClipboard, False)
+		engine_settings.setAttribute(QWebEngineSettings.PluginsEnabled, False)
+		engine_settings.setAttribute(QWebEngineSettings.WebGLEnabled, False)
+		engine_settings.setAttribute(QWebEngineSettings.Accelerated2dCanvasEnabled, False)
+
+	def handle_link(self, url):
+		if url.path() == "older":
+			self.show_older(int(QUrlQuery(url).queryItemValue("before") or 0))
+		elif url.path() == "newer":
+			self.show_newer(int(QUrlQuery(url).queryItemValue("after") or 0))
+		else:
+			self.internal_link.emit(url)
+
+	def generate_html(self, first, last, position=None):
+		"""Generate the page showing messages first to last. Scrolls to message position if given."""
+		items = "".join(f"<div class='chat-item' data-index='{i}'>{message}</div>" for i, message in enumerate(self.messages[first:last], first))
+		window_script = WINDOW_SCRIPT % {
+			"window": self.message_window,
+			"sizes": json.dumps([message_size(message) for message in self.messages]),
+			"first": first,
+			"last": last,
+		}
+
+		if position is not None:
+			scroll_script = f"document.querySelector('[data-index=\"{position}\"]').scrollIntoView({{ block: 'start' }});"
+		else:
+			scroll_script = "window.scrollTo(0, document.body.scrollHeight);"
+
+		return f"""
+		<html>
+			<head>
+				<style>
+					{self.stylesheet}
+					.chat-item {{
+						display: flow-root;
+					}}
+				</style>
+			</head>
+			<body>
+				<div id="older-spacer"></div>
+				{items}
+				<div id="newer-spacer"></div>
+				<script>
+				{window_script}
+				{scroll_script}
+				</script>
+			</body>
+		</html>
+		"""
+
+	@tracing.traced("WebChatView.setHtml")
+	def show_messages(self, messages, position=None):
+		"""Replace the transcript with a list of message HTML. Shows the last messages, or the window around position."""
+		self.messages = list(messages)
+		last = len(self.messages)
+		if position is not None:
+			last = min(last, max(0, position - self.message_window // 2) + self.message_window)
+		first = max(0, last - self.message_window)
+		self.setHtml(self.generate_html(first, last, position))
+
+	@tracing.traced("runJavaScript")
+	def show_older(self, before):
+		"""Give the page the batch of messages before index before."""
+		start = max(0, before - self.message_batch)
+		self.page().runJavaScript(f"prependMessages({start}, {json.dumps(self.messages[start:before])});")
+
+	@tracing.traced("runJavaScript")
+	def show_newer(self, after):
+		"""Give the page the batch of messages from index after on."""
+		end = min(len(self.messages), after + self.message_batch)
+		self.page().runJavaScript(f"appendMessages({after}, {json.dumps(self.messages[after:end])});")
+
+	@tracing.traced("runJavaScript")
+	def add_message(self, message_html, css_class, element_id=None, scroll_to_start=False):
+		"""Append a message to the transcript and scroll to it. Messages with an element_id are temporary and not kept."""
+		message_html = f"<div class='{css_class}'>{message_html}</div>"
+		if not element_id:
+			self.messages.append(message_html)
+
+		self.page().runJavaScript(f"addMessage({json.dumps(message_html)}, {json.dumps(message_size(message_html))}, {json.dumps(element_id)}, {json.dumps(scroll_to_start)});")
+
+	@tracing.traced("runJavaScript")
+	def remove_message(self, element_id):
+		"""Remove the message added with element_id, if it is still there."""
+		self.page().runJavaScript(f"""
+			var message = document.getElementById({json.dumps(element_id)});
+			if (message) message.remove();
+		""")
+
+	def loading_html(self):
+		"""Placeholder shown while a reply is generated."""
+		return f'<img src="data:image/gif;base64,{self.loading_gif_base64}" alt="Loading..." style="display: block;"><a href="clippy:stop">Stop</a>'
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+
+"""Build clippy.pack, a single memory-mappable file holding Clippy's decoded assets.
+
+The pack holds the sprite sheet (or trimmed atlas, if built) as raw premultiplied
+ARGB32 pixels, the animation table already resolved to frame indexes, and every
+sound effect decoded to PCM in a fixed format, ASSET_PACK_SOUND_FORMAT. A JSON
+index at the start records where each part lives, and the size and modification
+time of every source asset so Clippy can tell when the pack is out of date.
+Clippy maps the pack read-only at startup, so it doesn't decode anything and
+several Clippys share the same pages.
+
+--benchmark compares loading the pack at startup with loading the sprite sheet
+and animations.json. Sounds aren't timed, both paths load them on first use.
+"""
+
+import sys
+import os
+import json
+import time
+import struct
+import argparse
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+parser = argparse.ArgumentParser(description="Build the memory-mappable Clippy asset pack.")
+parser.add_argument("--out", default=None, help="Output path. (default: assets/clippy.pack)", metavar="PATH")
+parser.add_argument("--benchmark", action="store_true", help="Time loading the pack against loading the separate assets.")
+parser.add_argument("--runs", type=int, default=10, help="Benchmark repetitions. (default: 10)")
+tool_args = parser.parse_args()
+
+# main.py parses its own arguments on import. --light-ui keeps it from loading QtWebEngine.
+sys.argv = sys.argv[:1] + ["--light-ui"]
+import main
+
+def align(offset):
+	return (offset + main.ASSET_PACK_ALIGNMENT - 1) // main.ASSET_PACK_ALIGNMENT * main.ASSET_PACK_ALIGNMENT
+
+def load_sheet():
+	"""Return (sheet path, frames, frame map) the way ClippyWindow picks them without a pack."""
+	atlas = main.load_atlas(main.load_asset("clippy-atlas.json"))
+	if atlas:
+		return main.load_asset(atlas["image"]), [list(frame) for frame in atlas["frames"]], atlas["cells"]
+
+	frames = []
+	for row in range(main.SPRITE_ROWS):
+		for col in range(main.SPRITE_COLUMNS):
+			frames.append([col * main.SPRITE_WIDTH, row * main.SPRITE_HEIGHT, main.SPRITE_WIDTH, main.SPRITE_HEIGHT, 0, 0])
+	return main.load_asset("clippy-map.png"), frames, None
+
+def build_asset_pack(out_path):
+	sheet_path, frames, frame_map = load_sheet()
+	if frame_map is None:
+		print("Note: tools/build_atlas.py hasn't been run, packing the untrimmed sprite sheet.")
+	sheet = main.QImage(sheet_path).convertToFormat(main.QImage.Format_ARGB32_Premultiplied)
+
+	# Store sounds by file name rather than path, the pack can be moved.
+	animations = main.load_animations(main.load_asset("animations.json"), main.SPRITE_COLUMNS, frame_map)
+	for animation in animations.values():
+		animation["Frames"] = [[index, duration, os.path.basename(sound) if sound else None] for index, duration, sound in animation["Frames"]]
+	sound_names = sorted({sound for animation in animations.values() for _, _, sound in animation["Frames"] if sound})
+
+	# The atlas index is recorded even when it's missing, so building it later makes the pack stale.
+	source_names = [os.path.basename(sheet_path), "clippy-atlas.json", "animations.json"] + sound_names
+
+	# (offset from the start of the data, bytes) of everything after the index.
+	blobs = [(0, bytes(sheet.constBits()))]
+	index = {
+		"sheet": {"offset": 0, "length": len(blobs[0][1]), "width": sheet.width(), "height": sheet.height(), "bytes_per_line": sheet.bytesPerLine()},
+		"frames": frames,
+		"animations": animations,
+		"sound_format": list(main.pygame.mixer.get_init()),
+		"sounds": {},
+		"sources": {name: main.asset_stamp(name) for name in source_names},
+	}
+
+	offset = align(len(blobs[0][1]))
+	for name in sound_names:
+		pcm = main.pygame.mixer.Sound(main.load_asset(name)).get_raw()
+		index["sounds"][name] = {"offset": offset, "length": len(pcm)}
+		blobs.append((offset, pcm))
+		offset = align(offset + len(pcm))
+
+	index_bytes = json.dumps(index, separators=(",", ":")).encode("utf-8")
+	data_offset = align(struct.calcsize(main.ASSET_PACK_HEADER) + len(index_bytes))
+
+	with open(out_path, "wb") as f:
+		f.write(struct.pack(main.ASSET_PACK_HEADER, main.ASSET_PACK_MAGIC, main.ASSET_PACK_VERSION, len(index_bytes), data_offset))
+		f.write(index_bytes)
+		for blob_offset, blob in blobs:
+			# Pad so every part starts aligned.
+			f.write(b"\0" * (data_offset + blob_offset - f.tell()))
+			f.write(blob)
+
+	print(f"Wrote {out_path}: {os.path.getsize(out_path) / 2**20:.1f} MiB")
+	print(f"Sheet: {sheet.width()}x{sheet.height()}, frames: {len(frames)}, animations: {len(animations)}, sounds: {len(sound_names)}")
+
+def load_separate_assets():
+	"""What ClippyWindow does at startup without a pack: decode the sheet and parse animations.json. Sounds are decoded later, on first use."""
+	sheet_path, frames, frame_map = load_sheet()
+	sheet = main.QImage(sheet_path).convertToFormat(main.QImage.Format_ARGB32_Premultiplied)
+	animations = main.load_animations(main.load_asset("animations.json"), main.SPRITE_COLUMNS, frame_map)
+	return sheet, frames, animations
+
+def load_pack_assets(path):
+	"""What ClippyWindow does at startup with a pack, including the check that it is up to date."""
+	pack = main.AssetPack(path)
+	pack.changed_source()
+	return pack.sheet_image(), pack.frames(), pack.animations(), pack
+
+def benchmark(path, runs):
+	def time_ms(load):
+		start = time.perf_counter()
+		for _ in range(runs):
+			load()
+		return (time.perf_counter() - start) * 1000 / runs
+
+	separate_ms = time_ms(load_separate_assets)
+	pack_ms = time_ms(lambda: load_pack_assets(path))
+	print(f"Loading the sheet and animations at startup, average of {runs} runs:")
+	print(f"  Separate files: {separate_ms:.1f} ms")
+	print(f"  Asset pack:     {pack_ms:.1f} ms (pixels are read from disk as frames are first drawn)")
+
+if __name__ == '__main__':
+	app = main.QApplication(sys.argv)
+	# Decode sounds in the fixed format Clippy opens the mixer with when it uses a pack, not the device's.
+	main.pygame.mixer.init(*main.ASSET_PACK_SOUND_FORMAT, allowedchanges=0)
+
+	out_path = tool_args.out or os.path.normpath(main.load_asset(main.ASSET_PACK_NAME))
+	build_asset_pack(out_path)
+	if tool_args.benchmark:
+		benchmark(out_path, tool_args.runs)
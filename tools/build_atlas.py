@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+
+"""Build a trimmed, deduplicated sprite atlas from clippy-map.png.
+
+Every cell of the sprite sheet is trimmed to the bounding box of its visible
+pixels, identical frames are merged by hash and the survivors are shelf packed
+into clippy-atlas.png. clippy-atlas.json records where each frame lives in the
+atlas, the offset to draw it at and which frame each sheet cell maps to.
+"""
+
+import sys
+import os
+import json
+import math
+import time
+import hashlib
+import argparse
+from PySide6.QtGui import QGuiApplication, QImage, QPainter
+from PySide6.QtCore import Qt
+
+ASSETS_DIR = os.path.join(os.path.dirname(__file__), "..", "assets")
+
+SPRITE_WIDTH = 124
+SPRITE_HEIGHT = 93
+SHEET_COLUMNS = 27
+SHEET_ROWS = 34
+
+# Transparent gap between packed frames.
+PADDING = 1
+
+def trim_cell(data, stride, x0, y0, width, height):
+	"""Return (left, top, right, bottom) of the visible pixels in a cell, or None if it is empty."""
+	top, bottom = None, None
+	left, right = width, 0
+
+	for y in range(y0, y0 + height):
+		# Alpha is the fourth byte of every ARGB32 pixel.
+		row_alpha = data[y * stride + x0 * 4 + 3:y * stride + (x0 + width) * 4:4]
+		stripped = row_alpha.lstrip(b"\0")
+		if not stripped:
+			continue
+
+		if top is None:
+			top = y - y0
+		bottom = y - y0 + 1
+
+		left = min(left, width - len(stripped))
+		right = max(right, len(row_alpha.rstrip(b"\0")))
+
+	if top is None:
+		return None
+	return left, top, right, bottom
+
+def cell_pixels(data, stride, x, y, width, height):
+	"""Return the raw pixel bytes of a rectangle."""
+	return b"".join(data[row * stride + x * 4:row * stride + (x + width) * 4] for row in range(y, y + height))
+
+def pack_shelves(sizes, padding):
+	"""Shelf pack (width, height) boxes. Returns (atlas_width, atlas_height, positions)."""
+	if not sizes:
+		return 0, 0, []
+
+	area = sum((w + padding) * (h + padding) for w, h in sizes)
+	atlas_width = max(max(w for w, _ in sizes) + padding, int(math.ceil(math.sqrt(area * 1.1))))
+
+	# Tallest first keeps the shelves dense.
+	order = sorted(range(len(sizes)), key=lambda i: (sizes[i][1], sizes[i][0]), reverse=True)
+	positions = [None] * len(sizes)
+	x, y, shelf_height = 0, 0, 0
+	for i in order:
+		w, h = sizes[i]
+		if x + w > atlas_width:
+			x = 0
+			y += shelf_height + padding
+			shelf_height = 0
+		positions[i] = (x, y)
+		x += w + padding
+		shelf_height = max(shelf_height, h)
+
+	return atlas_width, y + shelf_height, positions
+
+def time_decode(path, runs=5):
+	"""Average time in milliseconds to decode an image file."""
+	start = time.perf_counter()
+	for _ in range(runs):
+		QImage(path).convertToFormat(QImage.Format_ARGB32_Premultiplied)
+	return (time.perf_counter() - start) * 1000 / runs
+
+def build_atlas(sheet_path, image_path, json_path):
+	source = QImage(sheet_path)
+	sheet = source.convertToFormat(QImage.Format_ARGB32)
+	stride = sheet.bytesPerLine()
+	data = bytes(sheet.constBits())
+
+	frames = []
+	cells = []
+	seen = {}
+
+	for row in range(SHEET_ROWS):
+		for col in range(SHEET_COLUMNS):
+			x0 = col * SPRITE_WIDTH
+			y0 = row * SPRITE_HEIGHT
+			bounds = trim_cell(data, stride, x0, y0, SPRITE_WIDTH, SPRITE_HEIGHT)
+			if bounds is None:
+				cells.append(None)
+				continue
+
+			left, top, right, bottom = bounds
+			width, height = right - left, bottom - top
+			pixels = cell_pixels(data, stride, x0 + left, y0 + top, width, height)
+
+			# Identical frames (same pixels at the same offset) are stored once.
+			key = (left, top, width, height, hashlib.sha1(pixels).digest())
+			if key not in seen:
+				seen[key] = len(frames)
+				frames.append([x0 + left, y0 + top, width, height, left, top])
+			cells.append(seen[key])
+
+	atlas_width, atlas_height, positions = pack_shelves([(f[2], f[3]) for f in frames], PADDING)
+
+	atlas = QImage(atlas_width, atlas_height, QImage.Format_ARGB32)
+	atlas.fill(Qt.transparent)
+	painter = QPainter(atlas)
+	painter.setCompositionMode(QPainter.CompositionMode_Source)
+	for frame, (x, y) in zip(frames, positions):
+		sx, sy, w, h = frame[:4]
+		painter.drawImage(x, y, sheet, sx, sy, w, h)
+		frame[0], frame[1] = x, y
+	painter.end()
+
+	# Keep the sheet's palette so the atlas decodes as cheaply as the original.
+	if source.format() == QImage.Format_Indexed8:
+		atlas = atlas.convertToFormat(QImage.Format_Indexed8, source.colorTable(), Qt.ThresholdDither | Qt.AvoidDither)
+
+	if not atlas.save(image_path, "PNG"):
+		raise RuntimeError(f"Failed to write {image_path}")
+
+	with open(json_path, "w", encoding="utf-8") as f:
+		json.dump({
+			"image": os.path.basename(image_path),
+			"cell_width": SPRITE_WIDTH,
+			"cell_height": SPRITE_HEIGHT,
+			"columns": SHEET_COLUMNS,
+			"rows": SHEET_ROWS,
+			"frames": frames,
+			"cells": cells,
+		}, f, separators=(",", ":"))
+
+	# Report what the atlas saves over one full size pixmap per cell.
+	cell_count = SHEET_ROWS * SHEET_COLUMNS
+	before_bytes = cell_count * SPRITE_WIDTH * SPRITE_HEIGHT * 4
+	after_bytes = atlas_width * atlas_height * 4
+	print(f"Cells: {cell_count}, empty: {cells.count(None)}, unique frames: {len(frames)}")
+	print(f"Atlas: {atlas_width}x{atlas_height}")
+	print(f"Frame memory: {before_bytes / 2**20:.1f} MiB -> {after_bytes / 2**20:.1f} MiB")
+	print(f"Decode time: {time_decode(sheet_path):.1f} ms -> {time_decode(image_path):.1f} ms")
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Build the trimmed Clippy sprite atlas.")
+	parser.add_argument("--sheet", default=os.path.join(ASSETS_DIR, "clippy-map.png"), help="Source sprite sheet.", metavar="PATH")
+	parser.add_argument("--out", default=os.path.join(ASSETS_DIR, "clippy-atlas"), help="Output path without extension.", metavar="PATH")
+	args = parser.parse_args()
+
+	app = QGuiApplication(sys.argv)
+	build_atlas(args.sheet, args.out + ".png", args.out + ".json")
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+"""Measure how far Clippy's animation clock drifts from the authored frame durations.
+
+Runs one animation headless and compares how long it actually took with the
+sum of the durations of every frame it stepped through. --load-ms adds work to
+every paint to see how the clock copes with a busy GUI thread.
+
+Exits with status 1 if the drift is larger than --max-drift-ms, so it can gate
+changes to the animation loop.
+"""
+
+import sys
+import os
+import time
+import argparse
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+parser = argparse.ArgumentParser(description="Measure animation clock drift.")
+parser.add_argument("--animation", default="IdleRopePile", help="Animation to play. (default: IdleRopePile)")
+parser.add_argument("--loops", type=int, default=20, help="Times to repeat each of the animation's loops. (default: 20)")
+parser.add_argument("--load-ms", type=float, default=0, help="Extra time to spend in every paint. (default: 0)")
+parser.add_argument("--max-drift-ms", type=float, default=50, help="Fail if the cumulative drift is larger than this, either way. (default: 50)")
+tool_args = parser.parse_args()
+
+# main.py parses its own arguments on import. --light-ui keeps it from loading QtWebEngine.
+sys.argv = sys.argv[:1] + ["--light-ui"]
+import main
+
+app = main.QApplication(sys.argv)
+window = main.ClippyWindow()
+window.idle_timer.stop()
+window.show()
+
+animation = tool_args.animation
+result = {}
+
+advance_frame = window.advance_frame
+def counting_advance_frame():
+	if not advance_frame():
+		# The animation finished and went back to Idle.
+		if "end" not in result:
+			result["end"] = time.monotonic()
+			app.quit()
+		return False
+	result["authored_ms"] += window.frame_duration()
+	result["frames"] += 1
+	return True
+window.advance_frame = counting_advance_frame
+
+paint_event = window.paintEvent
+def loaded_paint_event(event):
+	paint_event(event)
+	if tool_args.load_ms:
+		time.sleep(tool_args.load_ms / 1000)
+window.paintEvent = loaded_paint_event
+
+def start():
+	loops = len(window.animations[animation]["Loops"])
+	window.set_animation(animation, {i: tool_args.loops for i in range(loops)})
+	result["start"] = time.monotonic()
+	result["authored_ms"] = window.frame_duration()
+	result["frames"] = 1
+
+# Let the greeting animation get out of the way first.
+main.QTimer.singleShot(0, start)
+app.exec()
+
+actual_ms = (result["end"] - result["start"]) * 1000
+drift_ms = actual_ms - result["authored_ms"]
+print(f"Animation: {animation}, frames stepped: {result['frames']}")
+print(f"Authored: {result['authored_ms']:.0f} ms, actual: {actual_ms:.0f} ms")
+print(f"Cumulative drift: {drift_ms:+.1f} ms ({drift_ms / result['authored_ms'] * 100:+.2f}%)")
+
+if abs(drift_ms) > tool_args.max_drift_ms:
+	print(f"FAIL: drift is more than {tool_args.max_drift_ms:g} ms")
+	sys.exit(1)
+print("OK")